@@ -0,0 +1,797 @@
+# Description:
+#     Docker Engine stand-in for benchmarks, serves endpoints used by DockerRunner
+#     over unix socket. Containers do not run code: after start they sleep for run
+#     time, echo stdin, write generated output and exit.
+#
+# Usage:
+#     python -m benchmarks.fake_docker [--socket PATH] [--latency S] [--run-time S]
+#                                      [--output-size BYTES] [--failure-rate RATE]
+
+import io
+import re
+import json
+import time
+import random
+import asyncio
+import tarfile
+import argparse
+import posixpath
+
+from typing import Any, Dict, List, Match, Tuple, Union, Optional, Sequence
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+
+from runner.pool import RESET_COMMAND, IDLE_ENTRYPOINT
+from runner.stream import STDOUT
+
+DEFAULT_SOCKET = "/tmp/fake_docker.sock"
+
+LANGUAGES = ("asm", "c", "c-clang", "cpp", "node", "python", "sh")
+
+# exit code of killed process
+KILLED = 137
+
+REASONS = {
+    101: "UPGRADED",
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    304: "Not Modified",
+    404: "Not Found",
+    500: "Internal Server Error",
+}
+
+# handlers return None if they wrote response themselves
+_Response = Optional[Tuple[int, Union[bytes, Dict[str, Any], List[Any]]]]
+
+
+class NotFound(Exception):
+    pass
+
+
+class Process:
+    """Program run by container start or exec."""
+
+    def __init__(self, env: Sequence[str], stdin: bool, command: Sequence[str] = ()):
+        self.env = dict(variable.split("=", 1) for variable in env)
+        self.command = list(command)
+        self.stdin = bytearray()
+        self.stdin_open = stdin
+        self.stdin_closed = asyncio.Event()
+
+        # attached connections
+        self.outputs: List[asyncio.StreamWriter] = []
+
+        self.task: Optional["asyncio.Task[None]"] = None
+        self.exit_code: Optional[int] = None
+        self.exited = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.exited.is_set()
+
+    def finish(self, exit_code: int) -> None:
+        if self.exited.is_set():
+            return
+
+        self.exit_code = exit_code
+        self.exited.set()
+
+        for output in self.outputs:
+            output.close()
+
+    def kill(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+        self.finish(KILLED)
+
+
+class Container:
+    def __init__(self, container_id: str, config: Dict[str, Any]):
+        self.id = container_id
+        self.config = config
+        self.labels: Dict[str, str] = config.get("Labels") or {}
+        self.created = time.time()
+        self.idle = config.get("Entrypoint") == IDLE_ENTRYPOINT
+        self.files: Dict[str, bytes] = {}
+        self.process = Process(config.get("Env") or (), config.get("OpenStdin", False))
+        self.execs: List[Process] = []
+
+    def kill(self) -> None:
+        self.process.kill()
+
+        for process in self.execs:
+            process.kill()
+
+
+class FakeDocker:
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET,
+        latency: float = 0,
+        run_time: float = 0,
+        output_size: int = 64,
+        chunk_size: int = 4096,
+        exit_code: int = 0,
+        failure_rate: float = 0,
+        failing: Sequence[str] = ("create",),
+        seed: Optional[int] = None,
+    ):
+        """
+        latency is added to every request, run_time is time containers run for.
+        Requests to failing endpoints fail with failure_rate probability.
+        """
+
+        self._socket = socket_path
+        self._latency = latency
+        self._run_time = run_time
+        self._output_size = output_size
+        self._chunk_size = chunk_size
+        self._exit_code = exit_code
+        self._failure_rate = failure_rate
+        self._failing = set(failing)
+        self._random = random.Random(seed)
+
+        self._containers: Dict[str, Container] = {}
+
+        # every pull publishes new version of image
+        self._image_versions: "Counter[str]" = Counter()
+        self._execs: Dict[str, Tuple[Container, Process]] = {}
+
+        self.requests: "Counter[str]" = Counter()
+
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        self._routes = [
+            ("GET", r"/images/json", self._list_images),
+            ("POST", r"/images/create", self._pull),
+            ("GET", r"/images/(?P<name>.+)/json", self._inspect_image),
+            ("GET", r"/containers/json", self._list),
+            ("POST", r"/containers/create", self._create),
+            ("POST", r"/containers/prune", self._prune),
+            ("GET", r"/containers/(?P<id>\w+)/json", self._inspect),
+            ("PUT", r"/containers/(?P<id>\w+)/archive", self._put_archive),
+            ("GET", r"/containers/(?P<id>\w+)/archive", self._get_archive),
+            ("POST", r"/containers/(?P<id>\w+)/attach", self._attach),
+            ("POST", r"/containers/(?P<id>\w+)/wait", self._wait),
+            ("POST", r"/containers/(?P<id>\w+)/start", self._start),
+            ("POST", r"/containers/(?P<id>\w+)/(?:stop|kill)", self._stop),
+            ("POST", r"/containers/(?P<id>\w+)/update", self._update),
+            ("DELETE", r"/containers/(?P<id>\w+)", self._delete),
+            ("POST", r"/containers/(?P<id>\w+)/exec", self._create_exec),
+            ("POST", r"/exec/(?P<id>\w+)/start", self._start_exec),
+            ("GET", r"/exec/(?P<id>\w+)/json", self._inspect_exec),
+        ]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, self._socket
+        )
+
+    async def close(self) -> None:
+        for container in self._containers.values():
+            container.kill()
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            requests=dict(self.requests),
+            containers=len(self._containers),
+            running=sum(c.process.running for c in self._containers.values()),
+        )
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                body = await self._read_body(reader, headers)
+
+                url = urlsplit(target)
+                path = re.sub(r"^/v[\d.]+/", "/", url.path)
+                query = dict(parse_qsl(url.query))
+
+                response = await self._dispatch(
+                    method, path, query, body, reader, writer
+                )
+                if response is not None:
+                    self._respond(writer, *response)
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(
+        reader: asyncio.StreamReader, headers: Dict[str, str]
+    ) -> bytes:
+        if headers.get("transfer-encoding") == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await reader.readuntil(b"\r\n"))[:-2], 16)
+                body += await reader.readexactly(size + 2)
+                if not size:
+                    return bytes(body[:-2])
+
+                del body[-2:]
+
+        return await reader.readexactly(int(headers.get("content-length", 0)))
+
+    async def _dispatch(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> _Response:
+        for route_method, pattern, handler in self._routes:
+            match = re.fullmatch(pattern, path)
+            if route_method != method or match is None:
+                continue
+
+            endpoint = handler.__name__.lstrip("_")
+            self.requests[endpoint] += 1
+
+            if self._latency:
+                await asyncio.sleep(self._latency)
+
+            if endpoint in self._failing and self._random.random() < self._failure_rate:
+                return 500, {"message": "injected failure"}
+
+            try:
+                return await handler(match, query, body, reader, writer)
+            except NotFound as e:
+                return 404, {"message": f"No such object: {e}"}
+
+        return 404, {"message": f"page not found: {method} {path}"}
+
+    @staticmethod
+    def _respond(
+        writer: asyncio.StreamWriter,
+        status: int,
+        content: Union[bytes, Dict[str, Any], List[Any]],
+    ) -> None:
+        if isinstance(content, bytes):
+            content_type = "application/x-tar"
+            body = content
+        else:
+            content_type = "application/json"
+            body = json.dumps(content).encode()
+
+        if status in (204, 304):
+            body = b""
+
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "\r\n"
+            ).encode()
+            + body
+        )
+
+    def _container(self, match: Match[str]) -> Container:
+        container = self._containers.get(match["id"])
+        if container is None:
+            raise NotFound(match["id"])
+
+        return container
+
+    def _image(self, language: str, image: str) -> Dict[str, Any]:
+        image_id = f"sha256:{language}-{self._image_versions[language]}"
+
+        return {
+            "Id": image_id,
+            "RepoTags": [f"{image}:latest"],
+            "RepoDigests": [f"{image}@{image_id}"],
+        }
+
+    async def _list_images(self, *_: Any) -> _Response:
+        return 200, [self._image(language, image) for language, image in self._images()]
+
+    async def _inspect_image(self, match: Match[str], *_: Any) -> _Response:
+        for language, image in self._images():
+            if match["name"] in (image, f"{image}:latest"):
+                return (
+                    200,
+                    dict(
+                        self._image(language, image),
+                        Config={
+                            "Entrypoint": ["run_entrypoint.sh"],
+                            "Cmd": ["./exec_input"],
+                        },
+                    ),
+                )
+
+        raise NotFound(match["name"])
+
+    async def _pull(
+        self,
+        match: Match[str],
+        query: Dict[str, str],
+        body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> _Response:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+        )
+
+        languages = {image: language for language, image in self._images()}
+        language = languages.get(query.get("fromImage", ""))
+
+        if language is None:
+            events: List[Dict[str, Any]] = [
+                {"error": f"pull access denied for {query.get('fromImage')}"}
+            ]
+        else:
+            self._image_versions[language] += 1
+
+            events = [{"status": f"Pulling from {query['fromImage']}", "id": "latest"}]
+            for layer in ("layer0", "layer1"):
+                events.append(
+                    {
+                        "status": "Downloading",
+                        "id": layer,
+                        "progressDetail": {"current": 512, "total": 1024},
+                    }
+                )
+                events.append({"status": "Pull complete", "id": layer})
+
+            events.append({"status": "Status: Downloaded newer image"})
+
+        for event in events:
+            # pull takes some time
+            await asyncio.sleep(self._run_time)
+
+            data = json.dumps(event).encode() + b"\r\n"
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+        return None
+
+    @staticmethod
+    def _images() -> List[Tuple[str, str]]:
+        return [(language, f"iomirea/run-lang-{language}") for language in LANGUAGES]
+
+    async def _create(
+        self, match: Match[str], query: Dict[str, str], body: bytes, *_: Any
+    ) -> _Response:
+        container_id = "%064x" % self._random.getrandbits(256)
+        self._containers[container_id] = Container(container_id, json.loads(body))
+
+        return 201, {"Id": container_id, "Warnings": []}
+
+    def _filter(self, query: Dict[str, str]) -> List[Container]:
+        """Supports label presence and until filters, until is in seconds."""
+
+        filters = json.loads(query.get("filters", "{}"))
+
+        labels = filters.get("label", ())
+        created_before = min(
+            (
+                time.time() - float(until.rstrip("s"))
+                for until in filters.get("until", ())
+            ),
+            default=float("inf"),
+        )
+
+        return [
+            container
+            for container in self._containers.values()
+            if all(label in container.labels for label in labels)
+            and container.created < created_before
+        ]
+
+    async def _list(
+        self, match: Match[str], query: Dict[str, str], *_: Any
+    ) -> _Response:
+        return (
+            200,
+            [
+                {
+                    "Id": container.id,
+                    "Labels": container.labels,
+                    "Created": int(container.created),
+                    "State": "running" if container.process.running else "exited",
+                }
+                for container in self._filter(query)
+                if query.get("all") == "1" or container.process.running
+            ],
+        )
+
+    async def _prune(
+        self, match: Match[str], query: Dict[str, str], *_: Any
+    ) -> _Response:
+        deleted = [
+            container.id
+            for container in self._filter(query)
+            if not container.process.running
+        ]
+        for container_id in deleted:
+            del self._containers[container_id]
+
+        return 200, {"ContainersDeleted": deleted, "SpaceReclaimed": 0}
+
+    async def _inspect(self, match: Match[str], *_: Any) -> _Response:
+        container = self._container(match)
+
+        return (
+            200,
+            {
+                "Id": container.id,
+                "State": {
+                    "Running": container.process.running,
+                    "ExitCode": container.process.exit_code or 0,
+                },
+            },
+        )
+
+    async def _put_archive(
+        self, match: Match[str], query: Dict[str, str], body: bytes, *_: Any
+    ) -> _Response:
+        container = self._container(match)
+
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            for member in tar:
+                extracted = tar.extractfile(member)
+                if extracted is not None:
+                    path = posixpath.join(query["path"], member.name)
+                    container.files[path] = extracted.read()
+
+        return 200, {}
+
+    async def _get_archive(
+        self, match: Match[str], query: Dict[str, str], *_: Any
+    ) -> _Response:
+        container = self._container(match)
+        path = query["path"].rstrip("/")
+
+        # names are relative to parent of path like in docker
+        parent = posixpath.dirname(path)
+        files = {
+            posixpath.relpath(name, parent): content
+            for name, content in container.files.items()
+            if name == path or name.startswith(f"{path}/")
+        }
+        if not files:
+            raise NotFound(path)
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+
+                tar.addfile(info, io.BytesIO(content))
+
+        return 200, archive.getvalue()
+
+    async def _attach(
+        self,
+        match: Match[str],
+        query: Dict[str, str],
+        body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> _Response:
+        container = self._container(match)
+
+        await self._hijack(container.process, query.get("stdin") == "1", reader, writer)
+
+        return None
+
+    async def _hijack(
+        self,
+        process: Process,
+        stdin: bool,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """Streams output of process to connection until process exits, closes it."""
+
+        writer.write(
+            b"HTTP/1.1 101 UPGRADED\r\n"
+            b"Content-Type: application/vnd.docker.raw-stream\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Upgrade: tcp\r\n"
+            b"\r\n"
+        )
+
+        if process.exited.is_set():
+            writer.close()
+
+            return
+
+        # closed when process exits
+        process.outputs.append(writer)
+
+        if stdin and process.stdin_open:
+            while True:
+                chunk = await reader.read(self._chunk_size)
+                if not chunk:
+                    break
+
+                process.stdin += chunk
+
+            process.stdin_closed.set()
+
+        await process.exited.wait()
+
+    async def _wait(
+        self,
+        match: Match[str],
+        query: Dict[str, str],
+        body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> _Response:
+        container = self._container(match)
+
+        # headers are sent before container exits, like in docker
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+        )
+        await writer.drain()
+
+        if query.get("condition") == "next-exit" or container.process.task is None:
+            await container.process.exited.wait()
+
+        data = json.dumps(
+            {"StatusCode": container.process.exit_code, "Error": None}
+        ).encode()
+        writer.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(data), data))
+        await writer.drain()
+
+        return None
+
+    async def _start(self, match: Match[str], *_: Any) -> _Response:
+        container = self._container(match)
+        if container.process.task is not None:
+            return 304, {}
+
+        container.process.task = asyncio.create_task(
+            self._run(container, container.process, container.idle)
+        )
+
+        return 204, {}
+
+    async def _stop(self, match: Match[str], *_: Any) -> _Response:
+        container = self._container(match)
+        if not container.process.running:
+            return 304, {}
+
+        container.kill()
+
+        return 204, {}
+
+    async def _update(
+        self, match: Match[str], query: Dict[str, str], body: bytes, *_: Any
+    ) -> _Response:
+        container = self._container(match)
+        container.config.setdefault("HostConfig", {}).update(json.loads(body))
+
+        return 200, {"Warnings": []}
+
+    async def _delete(self, match: Match[str], *_: Any) -> _Response:
+        container = self._container(match)
+        container.kill()
+
+        del self._containers[container.id]
+
+        return 204, {}
+
+    async def _create_exec(
+        self, match: Match[str], query: Dict[str, str], body: bytes, *_: Any
+    ) -> _Response:
+        container = self._container(match)
+        config = json.loads(body)
+
+        exec_id = "%064x" % self._random.getrandbits(256)
+        process = Process(
+            config.get("Env") or (),
+            config.get("AttachStdin", False),
+            config.get("Cmd") or (),
+        )
+
+        container.execs.append(process)
+        self._execs[exec_id] = (container, process)
+
+        return 201, {"Id": exec_id}
+
+    async def _start_exec(
+        self,
+        match: Match[str],
+        query: Dict[str, str],
+        body: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> _Response:
+        exec_id = match["id"]
+        if exec_id not in self._execs:
+            raise NotFound(exec_id)
+
+        container, process = self._execs[exec_id]
+        if process.command == RESET_COMMAND:
+            process.task = asyncio.create_task(self._reset(container, process))
+        else:
+            process.task = asyncio.create_task(self._run(container, process))
+
+        await self._hijack(process, True, reader, writer)
+
+        return None
+
+    async def _inspect_exec(self, match: Match[str], *_: Any) -> _Response:
+        exec_id = match["id"]
+        if exec_id not in self._execs:
+            raise NotFound(exec_id)
+
+        _container, process = self._execs[exec_id]
+
+        # runner inspects exec until it is not running
+        if not process.running:
+            del self._execs[exec_id]
+
+        return 200, {"Running": process.running, "ExitCode": process.exit_code}
+
+    async def _run(
+        self, container: Container, process: Process, idle: bool = False
+    ) -> None:
+        """Imitates run_entrypoint.sh."""
+
+        try:
+            if idle:
+                await asyncio.Event().wait()
+
+            started_at = time.time_ns()
+
+            await asyncio.sleep(self._run_time)
+
+            env = process.env
+
+            stats_path = env.get("RUN_STATS_PATH")
+            if stats_path:
+                container.files.update(
+                    {
+                        f"{stats_path}/started": b"%d\n" % started_at,
+                        f"{stats_path}/compiled": b"%d\n" % started_at,
+                        f"{stats_path}/finished": b"%d\n" % time.time_ns(),
+                        f"{stats_path}/compile_cpu": b"user_usec 0\nsystem_usec 0\n",
+                        f"{stats_path}/cpu": b"user_usec %d\nsystem_usec 0\n"
+                        % (self._run_time * 1e6),
+                        f"{stats_path}/memory_peak": b"%d\n" % (1 << 20),
+                        f"{stats_path}/memory_events": b"oom 0\noom_kill 0\n",
+                    }
+                )
+
+            if env.get("COMPILE_COMMAND"):
+                container.files["/sandbox/exec_input"] = b"compiled"
+
+            if env.get("COMPILE_ONLY"):
+                pass
+            elif env.get("CASES"):
+                for i in range(int(env["CASES"])):
+                    output = f"/sandbox/batch_output/{i}"
+
+                    container.files[f"{output}.out"] = container.files.get(
+                        f"/sandbox/batch_input/{i}", b""
+                    )
+                    container.files[f"{output}.err"] = b""
+                    container.files[f"{output}.code"] = b"%d\n" % self._exit_code
+                    container.files[f"{output}.time"] = b"%d\n" % (self._run_time * 1e9)
+            else:
+                if process.stdin_open:
+                    await process.stdin_closed.wait()
+                    await self._write(process, bytes(process.stdin))
+
+                await self._write(process, b"x" * self._output_size)
+        except asyncio.CancelledError:
+            return
+
+        process.finish(self._exit_code)
+
+    async def _reset(self, container: Container, process: Process) -> None:
+        """Imitates reset of reused container, nothing is left after run."""
+
+        for name in list(container.files):
+            if name.startswith(("/sandbox/", "/tmp/")):
+                del container.files[name]
+
+        await self._write(process, b"0 0 0\n")
+
+        process.finish(0)
+
+    async def _write(self, process: Process, data: bytes) -> None:
+        for i in range(0, len(data), self._chunk_size):
+            chunk = data[i : i + self._chunk_size]
+            frame = bytes((STDOUT, 0, 0, 0)) + len(chunk).to_bytes(4, "big") + chunk
+
+            for output in list(process.outputs):
+                try:
+                    output.write(frame)
+                    # runner reads output at its own pace
+                    await output.drain()
+                except ConnectionError:
+                    process.outputs.remove(output)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    docker = FakeDocker(
+        args.socket,
+        latency=args.latency,
+        run_time=args.run_time,
+        output_size=args.output_size,
+        failure_rate=args.failure_rate,
+    )
+    await docker.start()
+
+    print(f"listening on {args.socket}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await docker.close()
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Fake docker engine")
+    argparser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET,
+        help=f"Socket path. Defaults to {DEFAULT_SOCKET}",
+    )
+    argparser.add_argument(
+        "--latency", type=float, default=0, help="Seconds added to every request"
+    )
+    argparser.add_argument(
+        "--run-time", type=float, default=0, help="Seconds containers run for"
+    )
+    argparser.add_argument(
+        "--output-size", type=int, default=64, help="Bytes written by containers"
+    )
+    argparser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0,
+        help="Probability of container create failing",
+    )
+
+    try:
+        asyncio.run(serve(argparser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# Description:
+#     Starts runner worker against fake docker engine and measures /run throughput,
+#     latency and worker memory at several concurrency levels. Worker is started with
+#     `python -m runner`, config is based on runner/data/config.example.yaml.
+#
+# Usage:
+#     python -m benchmarks.load_test [--concurrency 1,8,32] [--requests N]
+#                                    [--run-time S] [--latency S] [--output-size BYTES]
+#                                    [--set KEY=VALUE ...]
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+from typing import Any, Dict, List, Tuple
+
+import yaml
+import aiohttp
+
+from runner.constants import DATA_DIR
+
+from .fake_docker import FakeDocker
+from .run_overhead import percentile
+
+STARTUP_TIMEOUT = 30
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+
+        return s.getsockname()[1]
+
+
+def read_rss(pid: int) -> Tuple[int, int]:
+    """Returns current and peak resident memory of process in bytes."""
+
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, value = line.split(":", 1)
+            if name in ("VmRSS", "VmHWM"):
+                values[name] = int(value.split()[0]) * 1024
+
+    return values["VmRSS"], values["VmHWM"]
+
+
+def make_config(socket_path: str, overrides: List[str]) -> Dict[str, Any]:
+    with open(os.path.join(DATA_DIR, "config.example.yaml")) as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+
+    config["docker"]["socket"] = socket_path
+    config["app"]["max-containers"] = 16
+    config["app"]["queue-size"] = 10000
+    config["app"]["queue-timeout"] = 600
+
+    for override in overrides:
+        key, value = override.split("=", 1)
+        config["app"][key] = yaml.load(value, Loader=yaml.SafeLoader)
+
+    return config
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+
+        if time.monotonic() > deadline:
+            raise RuntimeError("worker did not start")
+
+        await asyncio.sleep(0.1)
+
+
+async def load(
+    session: aiohttp.ClientSession,
+    url: str,
+    concurrency: int,
+    requests: int,
+    body: Dict[str, Any],
+) -> Tuple[float, List[float], int]:
+    """Returns elapsed time, latencies of successful requests and number of errors."""
+
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def client() -> None:
+        nonlocal remaining, errors
+
+        while remaining > 0:
+            remaining -= 1
+
+            started_at = time.perf_counter()
+            async with session.post(url, json=body) as resp:
+                await resp.read()
+
+            if resp.status == 200:
+                latencies.append(time.perf_counter() - started_at)
+            else:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return time.perf_counter() - started_at, latencies, errors
+
+
+async def run(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        docker = FakeDocker(
+            os.path.join(directory, "docker.sock"),
+            latency=args.latency,
+            run_time=args.run_time,
+            output_size=args.output_size,
+        )
+        await docker.start()
+
+        config_path = os.path.join(directory, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.dump(make_config(os.path.join(directory, "docker.sock"), args.set), f)
+
+        port = free_port()
+
+        worker = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "runner",
+            "--config-file",
+            config_path,
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--verbosity",
+            "warning",
+            env={**os.environ, "GIT_COMMIT": "load-test"},
+        )
+
+        base_url = f"http://127.0.0.1:{port}"
+        body = dict(code=args.code, input=args.input, merge_output=False)
+
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=None)
+
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                await wait_ready(session, f"{base_url}/")
+
+                print(
+                    f"{'concurrency':>11}{'runs/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+                    f"{'errors':>8}{'rss MiB':>10}{'peak MiB':>10}"
+                )
+
+                for concurrency in args.concurrency:
+                    elapsed, latencies, errors = await load(
+                        session,
+                        f"{base_url}/run/{args.language}",
+                        concurrency,
+                        args.requests,
+                        body,
+                    )
+                    rss, peak_rss = read_rss(worker.pid)
+
+                    p50 = percentile(latencies, 0.5) * 1000 if latencies else 0
+                    p99 = percentile(latencies, 0.99) * 1000 if latencies else 0
+
+                    print(
+                        f"{concurrency:>11}{len(latencies) / elapsed:>10.1f}"
+                        f"{p50:>10.1f}{p99:>10.1f}{errors:>8}"
+                        f"{rss / 2 ** 20:>10.1f}{peak_rss / 2 ** 20:>10.1f}"
+                    )
+
+                    if args.verbose:
+                        print(
+                            f"  mean {statistics.mean(latencies or [0]) * 1000:.1f} ms"
+                        )
+                        print(f"  docker: {docker.stats()}")
+        finally:
+            worker.terminate()
+            await worker.wait()
+
+            await docker.close()
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Runner load test")
+    argparser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 8, 32, 128],
+        help="Comma separated numbers of concurrent clients",
+    )
+    argparser.add_argument(
+        "--requests", type=int, default=500, help="Runs per concurrency level"
+    )
+    argparser.add_argument("--language", default="python", help="Language to run")
+    argparser.add_argument("--code", default="print(input())", help="Code to run")
+    argparser.add_argument("--input", default="hello", help="Input of runs")
+    argparser.add_argument(
+        "--latency", type=float, default=0, help="Seconds added to docker requests"
+    )
+    argparser.add_argument(
+        "--run-time", type=float, default=0.05, help="Seconds containers run for"
+    )
+    argparser.add_argument(
+        "--output-size", type=int, default=64, help="Bytes written by containers"
+    )
+    argparser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Overrides app config value, e.g. --set warm-pool-size=4",
+    )
+    argparser.add_argument(
+        "--verbose", action="store_true", help="Prints docker request counts"
+    )
+
+    asyncio.run(run(argparser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
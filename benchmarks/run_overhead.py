@@ -0,0 +1,102 @@
+# Description:
+#     Measures docker overhead of a single run: wall time minus reported exec time
+#     and number of docker api requests per run. Run on two commits to compare
+#     container lifecycle changes.
+#
+# Usage:
+#     python -m benchmarks.run_overhead [--socket PATH] [--runs N] [--language NAME]
+
+import time
+import asyncio
+import argparse
+import statistics
+
+from typing import Any, List
+
+import aiohttp
+
+from runner.runner import DockerRunner
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+DEFAULT_CODE = {
+    "python": "print(1)",
+    "sh": "echo 1",
+    "node": "console.log(1)",
+}
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    requests = 0
+
+    async def on_request_start(*_: Any) -> None:
+        nonlocal requests
+        requests += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+
+    runner = DockerRunner(args.socket, "512m", 0.5, 1)
+    await runner.setup()
+
+    # same connection settings, requests are counted
+    await runner._session.close()
+    runner._session = aiohttp.ClientSession(
+        connector=aiohttp.UnixConnector(path=args.socket),
+        trace_configs=[trace_config],
+    )
+
+    code = args.code or DEFAULT_CODE.get(args.language, "")
+
+    wall_times = []
+    overheads = []
+
+    try:
+        # warms up image cache and connection pool
+        await runner.run_code(args.language, code, None, [], False)
+
+        requests = 0
+
+        for _ in range(args.runs):
+            started_at = time.perf_counter()
+            result = await runner.run_code(args.language, code, None, [], False)
+            wall_time = time.perf_counter() - started_at
+
+            wall_times.append(wall_time)
+            overheads.append(wall_time - float(result["exec_time"]))
+    finally:
+        await runner.close()
+
+    print(f"runs:              {args.runs}")
+    print(f"requests per run:  {requests / args.runs:.1f}")
+    for name, samples in (("wall time", wall_times), ("overhead", overheads)):
+        print(
+            f"{name + ' ms:':<19}"
+            f"mean {statistics.mean(samples) * 1000:8.1f}  "
+            f"p50 {percentile(samples, 0.5) * 1000:8.1f}  "
+            f"p99 {percentile(samples, 0.99) * 1000:8.1f}"
+        )
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Per run docker overhead")
+    argparser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET,
+        help=f"Docker socket path. Defaults to {DEFAULT_SOCKET}",
+    )
+    argparser.add_argument("--runs", type=int, default=50, help="Number of runs")
+    argparser.add_argument("--language", default="python", help="Language to run")
+    argparser.add_argument("--code", help="Code to run, trivial program by default")
+
+    asyncio.run(run(argparser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
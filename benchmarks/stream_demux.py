@@ -0,0 +1,122 @@
+# Usage:
+#     python -m benchmarks.stream_demux [--repeat N] [--legacy]
+
+import os
+import time
+import random
+import argparse
+
+from typing import Dict, List, Tuple, Callable, Iterator
+
+from runner.stream import STDERR, STDOUT, HEADER_SIZE, StreamDemultiplexer
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# (name, total payload size, frame payload size)
+STREAMS = [
+    ("tiny frames", MIB, 16),
+    ("line frames", MIB, 80),
+    ("page frames", 4 * MIB, 4 * KIB),
+    ("large frames", 16 * MIB, 64 * KIB),
+]
+
+# size of chunks stream is split into before feeding, None feeds stream at once
+SPLITS = [7, 1 * KIB, 64 * KIB, None]
+
+
+def make_stream(total_size: int, frame_size: int) -> bytes:
+    rnd = random.Random(total_size ^ frame_size)
+    payload = os.urandom(frame_size)
+
+    frames = []
+    for _ in range(total_size // frame_size):
+        stream_type = rnd.choice((STDOUT, STDERR))
+        frames.append(
+            bytes((stream_type, 0, 0, 0))
+            + frame_size.to_bytes(4, byteorder="big")
+            + payload
+        )
+
+    return b"".join(frames)
+
+
+def split_stream(data: bytes, size: int) -> List[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def demultiplex(chunks: List[bytes]) -> Dict[int, bytearray]:
+    demultiplexer = StreamDemultiplexer()
+    output = {STDOUT: bytearray(), STDERR: bytearray()}
+
+    for chunk in chunks:
+        for stream_type, piece in demultiplexer.feed(chunk):
+            output[stream_type] += piece
+
+    return output
+
+
+def demultiplex_legacy(data: bytes) -> Dict[int, bytes]:
+    """Frame reading approach used before StreamDemultiplexer, for reference."""
+
+    output = {STDOUT: b"", STDERR: b""}
+
+    position = 0
+    while position < len(data):
+        header = data[position : position + HEADER_SIZE]
+        position += HEADER_SIZE
+
+        size = int.from_bytes(header[4:], byteorder="big")
+        output[header[0]] += data[position : position + size]
+        position += size
+
+    return output
+
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def run(repeat: int, legacy: bool) -> Iterator[Tuple[str, str, float]]:
+    for name, total_size, frame_size in STREAMS:
+        data = make_stream(total_size, frame_size)
+
+        for split in SPLITS:
+            chunks = [data] if split is None else split_stream(data, split)
+
+            elapsed = measure(lambda: demultiplex(chunks), repeat)
+            yield name, "whole" if split is None else str(split), len(data) / elapsed
+
+        if legacy:
+            elapsed = measure(lambda: demultiplex_legacy(data), repeat)
+            yield name, "legacy", len(data) / elapsed
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(
+        description="StreamDemultiplexer throughput benchmark"
+    )
+    argparser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per case, best is reported"
+    )
+    argparser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="Also measure bytes concatenation reader",
+    )
+
+    args = argparser.parse_args()
+
+    print(f"{'stream':<14}{'chunk':>8}{'MiB/s':>12}")
+    for name, split, throughput in run(args.repeat, args.legacy):
+        print(f"{name:<14}{split:>8}{throughput / MIB:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Description:
+#     Compares throughput and cpu usage of reading large subprocess output with
+#     runner.utils.Subprocess and with polling reader it replaced.
+#
+# Usage:
+#     python -m benchmarks.subprocess_read [--repeat N] [--sizes MIB ...]
+
+import time
+import asyncio
+import argparse
+import resource
+
+from typing import Dict, List, Tuple, Iterator, Optional, Awaitable
+
+from runner.utils import Subprocess
+
+MIB = 1024 * 1024
+
+# legacy reader concatenates bytes, its time grows quadratically with size
+DEFAULT_SIZES = [4, 16, 64]
+
+# interval and rate of removed ShellResult.read
+LEGACY_INTERVAL = 0.3
+LEGACY_RATE = 100
+LEGACY_MIN_CHUNK_SIZE = 100
+
+
+def command(size: int) -> str:
+    return f"head -c {size} /dev/zero"
+
+
+async def read(size: int) -> int:
+    process = await Subprocess.start(command(size), head=MIB, tail=MIB)
+    async with process:
+        await process.wait()
+
+    return process.stdout.received
+
+
+async def read_legacy(size: int) -> int:
+    """Polling reader used before Subprocess, for reference."""
+
+    process = await asyncio.create_subprocess_shell(
+        command(size), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    assert process.stdout is not None
+    assert process.stderr is not None
+
+    output = {"stdout": b"", "stderr": b""}
+
+    # whole output is read
+    read_limit = size + 1
+    chunk_size = (
+        int(read_limit * LEGACY_INTERVAL / LEGACY_RATE) or LEGACY_MIN_CHUNK_SIZE
+    )
+
+    tasks: Dict[str, Optional["asyncio.Task[None]"]] = {"stdout": None, "stderr": None}
+
+    async def read_task(stream: asyncio.StreamReader, name: str) -> None:
+        nonlocal read_limit
+
+        chunk = await stream.read(chunk_size)
+        read_limit -= len(chunk)
+        output[name] += chunk
+
+        tasks[name] = None
+
+    streams = [("stdout", process.stdout), ("stderr", process.stderr)]
+    while read_limit > 0:
+        for name, stream in streams:
+            if tasks[name] is None and not stream.at_eof():
+                tasks[name] = asyncio.create_task(read_task(stream, name))
+
+        to_wait = [task for task in tasks.values() if task is not None]
+        if not to_wait:
+            break
+
+        await asyncio.wait(
+            to_wait, timeout=LEGACY_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+        )
+
+    await process.wait()
+
+    return len(output["stdout"])
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(reader: Awaitable[int], size: int) -> Tuple[float, float]:
+    """Returns wall and cpu time of this process."""
+
+    started_at = time.perf_counter()
+    cpu_started_at = cpu_time()
+
+    received = asyncio.get_event_loop().run_until_complete(reader)
+    assert received == size, (received, size)
+
+    return time.perf_counter() - started_at, cpu_time() - cpu_started_at
+
+
+def run(sizes: List[int], repeat: int) -> Iterator[Tuple[int, str, float, float]]:
+    for size in sizes:
+        for name, reader in (("subprocess", read), ("legacy", read_legacy)):
+            wall, cpu = min(
+                measure(reader(size * MIB), size * MIB) for _ in range(repeat)
+            )
+
+            yield size, name, size / wall, cpu
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(
+        description="Subprocess output reading benchmark"
+    )
+    argparser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per case, best is reported"
+    )
+    argparser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Output sizes in MiB",
+    )
+
+    args = argparser.parse_args()
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    print(f"{'MiB':>6}{'reader':>12}{'MiB/s':>10}{'cpu s':>8}")
+    for size, name, throughput, cpu in run(args.sizes, args.repeat):
+        print(f"{size:>6}{name:>12}{throughput:>10.1f}{cpu:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
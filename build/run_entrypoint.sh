@@ -1,19 +1,40 @@
 #!/bin/sh
 
 # Description:
-#     This script runs provided command with timeout.
+#     This script runs provided command with timeout. Stdin of script is passed to
+#     command.
+#
+# Files:
+#     exec_input:
+#         Source code or compiled program. Created by COMPILE_COMMAND if it is set.
+#     compile_input:
+#         Source code, only used by COMPILE_COMMAND.
 #
 # Env variables:
-#     CODE:
-#         Source code.
-#     INPUT:
-#         Stdin.
 #     COMPILE_COMMAND:
 #         Compilation command. Should output result from `compile_input` to `exec_input`.
+#     COMPILE_ONLY:
+#         Exits after compilation if set, command is not run.
+#     RUN_STATS_PATH:
+#         Directory to write accounting of run to if set. Files `started`, `compiled`
+#         and `finished` contain timestamps in nanoseconds, `compile_cpu` and `cpu`
+#         contain cgroup cpu usage after compilation and at the end, `memory_peak` and
+#         `memory_events` contain cgroup peak memory usage and oom kill count.
+#         Empty `timed_out` file is created if TIMEOUT was reached.
+#     PRECOMPILED:
+#         Skips compilation if set. `exec_input` should already exist.
 #     TIMEOUT:
 #         Timeout for execution in seconds. Defaults to 30.
 #     MERGE_OUTPUT:
 #         Merges stdout and stderr in stdout if set.
+#     CASES:
+#         Enables batch mode if set. Code is compiled once and then run for each case
+#         with stdin from `batch_input/<case>`. Results are written to
+#         `batch_output/<case>.{out,err,code,time}`, time is in nanoseconds.
+#     CASE_TIMEOUTS:
+#         Space separated timeouts of cases in seconds.
+#     CASE_OUTPUT_LIMITS:
+#         Space separated stdout and stderr size limits of cases in bytes.
 #
 # Usage:
 #     ./run_entrypoint.sh <arguments>
@@ -24,14 +45,10 @@
 
 set -e
 
-INPUT=${INPUT:-""}
 TIMEOUT=${TIMEOUT:-30}
 
-if [ -z "$COMPILE_COMMAND" ]; then
-  printf '%s' "$CODE" > exec_input
+if [ -n "$PRECOMPILED" ] || [ -z "$COMPILE_COMMAND" ]; then
   COMPILE_COMMAND=true
-else
-  printf '%s' "$CODE" > compile_input
 fi
 
 if [ -n "$MERGE_OUTPUT" ]; then
@@ -39,8 +56,98 @@ if [ -n "$MERGE_OUTPUT" ]; then
 fi
 
 script='
-  eval "$COMPILE_COMMAND"
-  printf "%s" "$INPUT" | "$@"
+  # stdin is left for program
+  eval "$COMPILE_COMMAND" < /dev/null
+
+  if [ -n "$RUN_STATS_PATH" ]; then
+    date +%s%N > "$RUN_STATS_PATH/compiled"
+    # cgroup v2 and v1 files, only one of them exists
+    cat /sys/fs/cgroup/cpu.stat /sys/fs/cgroup/cpuacct/cpuacct.stat \
+      > "$RUN_STATS_PATH/compile_cpu" 2> /dev/null || true
+  fi
+
+  if [ -n "$COMPILE_ONLY" ]; then
+    exit
+  fi
+
+  if [ -z "$CASES" ]; then
+    "$@"
+    exit
+  fi
+
+  mkdir -p batch_output
+
+  i=0
+  for case_timeout in $CASE_TIMEOUTS; do
+    limit=$(echo $CASE_OUTPUT_LIMITS | cut -d " " -f $((i + 1)))
+    out=batch_output/$i
+
+    start=$(date +%s%N)
+
+    if [ -n "$MERGE_OUTPUT" ]; then
+      {
+        if timeout --preserve-status --k=1s "$case_timeout" "$@" < batch_input/$i; then
+          code=0
+        else
+          code=$?
+        fi
+        echo $code > $out.code
+      } 2>&1 | head -c "$limit" > $out.out
+
+      : > $out.err
+    else
+      {
+        {
+          if timeout --preserve-status --k=1s "$case_timeout" "$@" < batch_input/$i; then
+            code=0
+          else
+            code=$?
+          fi
+          echo $code > $out.code
+        } 2>&1 1>&3 | head -c "$limit" > $out.err
+      } 3>&1 | head -c "$limit" > $out.out
+    fi
+
+    end=$(date +%s%N)
+    echo $((end - start)) > $out.time
+
+    i=$((i + 1))
+  done
 '
 
-timeout --preserve-status --k=1s "$TIMEOUT" sh -e -c "$script" x "$@"
+started=$(date +%s%N)
+
+if [ -n "$RUN_STATS_PATH" ]; then
+  mkdir -p "$RUN_STATS_PATH"
+  echo $started > "$RUN_STATS_PATH/started"
+fi
+
+if timeout --preserve-status --k=1s "$TIMEOUT" sh -e -c "$script" x "$@"; then
+  code=0
+else
+  code=$?
+fi
+
+finished=$(date +%s%N)
+
+if [ -n "$RUN_STATS_PATH" ]; then
+  echo $finished > "$RUN_STATS_PATH/finished"
+
+  # timeout fires between these timestamps, exit status of timeout is status of
+  # killed command. Runs finishing right before timeout are counted too
+  if awk -v elapsed=$((finished - started)) -v timeout="$TIMEOUT" \
+    'BEGIN { exit !(elapsed >= timeout * 1e9) }'; then
+    : > "$RUN_STATS_PATH/timed_out"
+  fi
+
+  # cgroup v2 and v1 files, only one of each pair exists
+  cgroup=/sys/fs/cgroup
+  cat $cgroup/cpu.stat $cgroup/cpuacct/cpuacct.stat \
+    > "$RUN_STATS_PATH/cpu" 2> /dev/null || true
+  cat $cgroup/memory.peak $cgroup/memory/memory.max_usage_in_bytes \
+    > "$RUN_STATS_PATH/memory_peak" 2> /dev/null || true
+  cat $cgroup/memory.events $cgroup/memory/memory.oom_control \
+    > "$RUN_STATS_PATH/memory_events" 2> /dev/null || true
+fi
+
+exit $code
@@ -11,22 +11,34 @@ from sentry_sdk.integrations.aiohttp import AioHttpIntegration
 
 from .cli import args
 from .rpc import setup as setup_rpc
+from .jobs import setup as setup_jobs
 from .config import read_config
 from .logger import setup as setup_logger
 from .routes import routes
 from .runner import setup as setup_runner
+from .runner import cleanup as cleanup_runner
+from .runner import dumb_megabytes_to_bytes
+from .capacity import setup as setup_capacity
 
 DEBUG_MODE = args.verbosity == logging.DEBUG
 
 
 def create_app(config: Dict[str, Any]) -> web.Application:
-    app = web.Application()
+    app = web.Application(
+        client_max_size=dumb_megabytes_to_bytes(
+            config["app"].get("max-request-size", "1m")
+        )
+    )
     app["config"] = config
     app.add_routes(routes)
 
+    app.on_startup.append(setup_runner)
+    app.on_cleanup.append(cleanup_runner)
+
     setup_rpc(app)
 
-    app.on_startup.append(setup_runner)
+    setup_capacity(app)
+    setup_jobs(app)
 
     return app
 
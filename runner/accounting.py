@@ -0,0 +1,147 @@
+import os
+
+from typing import Any, Dict, Tuple, Union, Optional
+
+# cpuacct.stat of cgroup v1 is in these units
+USER_HZ = 100
+
+USAGE_FIELDS = (
+    "compile_time",
+    "execute_time",
+    "cpu_user_time",
+    "cpu_system_time",
+    "peak_memory",
+)
+
+_UsageType = Dict[str, Union[int, float, bool, None]]
+
+
+def _read_int(content: Optional[bytes]) -> Optional[int]:
+    """Returns first number in file, files of both cgroup versions are concatenated."""
+
+    if not content:
+        return None
+
+    try:
+        return int(content.split()[0])
+    except ValueError:
+        return None
+
+
+def _read_pairs(content: Optional[bytes]) -> Dict[str, int]:
+    pairs = {}
+    for line in (content or b"").decode(errors="replace").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            pairs[parts[0]] = int(parts[1])
+
+    return pairs
+
+
+def _read_cpu(content: Optional[bytes]) -> Optional[Tuple[float, float]]:
+    """Returns user and system cpu seconds from cpu.stat (v2) or cpuacct.stat (v1)."""
+
+    pairs = _read_pairs(content)
+
+    if "user_usec" in pairs and "system_usec" in pairs:
+        return pairs["user_usec"] / 1e6, pairs["system_usec"] / 1e6
+
+    if "user" in pairs and "system" in pairs:
+        return pairs["user"] / USER_HZ, pairs["system"] / USER_HZ
+
+    return None
+
+
+def parse_usage(files: Dict[str, bytes], compiled: bool) -> _UsageType:
+    """
+    Parses files written by entrypoint to RUN_STATS_PATH. Values are None if they are
+    not available: image is outdated, kernel does not report them or phase did not run.
+
+    Timestamps are in nanoseconds. Cpu time and peak memory are read from container
+    cgroup, cpu time is counted after compilation. Timed out is set by entrypoint once
+    TIMEOUT is reached.
+    """
+
+    files = {os.path.basename(name): content for name, content in files.items()}
+
+    started_at = _read_int(files.get("started"))
+    compiled_at = _read_int(files.get("compiled"))
+    finished_at = _read_int(files.get("finished"))
+
+    compile_time = execute_time = None
+    if started_at is not None and compiled:
+        # compilation failed or timed out if it did not finish
+        compile_end = compiled_at if compiled_at is not None else finished_at
+        if compile_end is not None:
+            compile_time = (compile_end - started_at) / 1e9
+
+    if compiled_at is not None and finished_at is not None:
+        execute_time = (finished_at - compiled_at) / 1e9
+
+    cpu_user_time = cpu_system_time = None
+    cpu = _read_cpu(files.get("cpu"))
+    compile_cpu = _read_cpu(files.get("compile_cpu"))
+    if cpu is not None and compile_cpu is not None:
+        # rounded to microseconds, precision of cgroup v2
+        cpu_user_time = max(0.0, round(cpu[0] - compile_cpu[0], 6))
+        cpu_system_time = max(0.0, round(cpu[1] - compile_cpu[1], 6))
+
+    events = _read_pairs(files.get("memory_events"))
+
+    return dict(
+        compile_time=compile_time,
+        execute_time=execute_time,
+        cpu_user_time=cpu_user_time,
+        cpu_system_time=cpu_system_time,
+        peak_memory=_read_int(files.get("memory_peak")),
+        oom_killed=events["oom_kill"] > 0 if "oom_kill" in events else None,
+        timed_out=None if finished_at is None else "timed_out" in files,
+    )
+
+
+class UsageStats:
+    """Aggregates resource usage of runs per language."""
+
+    def __init__(self) -> None:
+        # language -> field -> (number of runs with value, sum of values)
+        self._totals: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        self._runs: Dict[str, int] = {}
+        self._oom_kills: Dict[str, int] = {}
+        self._max_peak_memory: Dict[str, int] = {}
+
+    def observe(self, language: str, usage: _UsageType) -> None:
+        self._runs[language] = self._runs.get(language, 0) + 1
+
+        totals = self._totals.setdefault(language, {})
+        for field in USAGE_FIELDS:
+            value = usage.get(field)
+            if value is None:
+                continue
+
+            count, total = totals.get(field, (0, 0.0))
+            totals[field] = (count + 1, total + value)
+
+        if usage.get("oom_killed"):
+            self._oom_kills[language] = self._oom_kills.get(language, 0) + 1
+
+        peak_memory = usage.get("peak_memory")
+        if peak_memory is not None:
+            self._max_peak_memory[language] = max(
+                self._max_peak_memory.get(language, 0), int(peak_memory)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for language, runs in self._runs.items():
+            language_stats: Dict[str, Any] = dict(
+                runs=runs,
+                oom_kills=self._oom_kills.get(language, 0),
+                max_peak_memory=self._max_peak_memory.get(language),
+            )
+            for field in USAGE_FIELDS:
+                count, total = self._totals[language].get(field, (0, 0.0))
+                language_stats[f"avg_{field}"] = total / count if count else None
+
+            stats[language] = language_stats
+
+        return stats
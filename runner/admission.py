@@ -0,0 +1,340 @@
+import math
+import time
+import heapq
+import asyncio
+import logging
+
+from typing import Any, Dict, List, Tuple, Mapping, Optional
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# weight of last run in moving average of slot hold time
+HOLD_TIME_SMOOTHING = 0.1
+
+# hold time assumed for languages without finished runs
+DEFAULT_HOLD_TIME = 1.0
+
+_Waiter = Tuple[int, int, "asyncio.Future[None]"]
+
+
+class LanguageLimits:
+    """
+    Slots taken by run of language and limit of concurrent runs of it.
+
+    Virtual time is the number of slot seconds language has been given, runs of
+    languages with least virtual time are admitted first.
+    """
+
+    def __init__(self, cost: int = 1, max_running: Optional[int] = None):
+        self.cost = cost
+        self.max_running = max_running
+
+        self.running = 0
+        self.virtual_time = 0.0
+        self.hold_time = DEFAULT_HOLD_TIME
+
+        self.waiters: List[_Waiter] = []
+
+        self.admitted = 0
+        self.queued = 0
+        self.slot_seconds = 0.0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def full(self) -> bool:
+        return self.max_running is not None and self.running >= self.max_running
+
+    def head(self) -> Optional[_Waiter]:
+        """Returns first waiter that is not timed out or cancelled."""
+
+        while self.waiters and self.waiters[0][2].done():
+            heapq.heappop(self.waiters)
+
+        return self.waiters[0] if self.waiters else None
+
+    def stats(self, slots: int) -> Dict[str, Any]:
+        return dict(
+            cost=self.cost,
+            max_running=self.max_running,
+            running=self.running,
+            utilization=self.running * self.cost / slots if slots else 0,
+            queue_size=sum(not waiter.done() for _, _, waiter in self.waiters),
+            admitted=self.admitted,
+            queued=self.queued,
+            slot_seconds=self.slot_seconds,
+            average_wait_time=self.total_wait_time / self.queued if self.queued else 0,
+            max_wait_time=self.max_wait_time,
+        )
+
+
+class AdmissionQueue:
+    """
+    Limits number of concurrent runs, queues runs over limit.
+
+    Run takes cost slots of its language, number of concurrent runs of language can be
+    limited. Waiters with higher priority are admitted first. Waiters with equal
+    priority are admitted weighted-fair: language given least slot time goes first,
+    runs of the same language are admitted in FIFO order.
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        max_queue_size: int = 0,
+        max_wait: float = 0,
+        language_limits: Mapping[str, LanguageLimits] = {},
+    ):
+        self._slots = slots
+        self._max_queue_size = max_queue_size
+        self._max_wait = max_wait
+
+        self._languages = dict(language_limits)
+
+        self._running = 0
+        # sum of costs of running runs
+        self._used = 0
+        self._closed = False
+
+        # virtual time of last admitted language, languages that start waiting are
+        # moved to it to not get slots for time they were idle
+        self._virtual_time = 0.0
+
+        self._queue_size = 0
+        self._counter = 0
+
+        self._admitted = 0
+        self._queued = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._hold_time = 0.0
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    @slots.setter
+    def slots(self, slots: int) -> None:
+        self._slots = slots
+
+        self._wake_up()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue_size
+
+    @property
+    def max_queue_size(self) -> int:
+        return self._max_queue_size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def busy(self) -> bool:
+        if self._closed:
+            return True
+
+        return self._used >= self._slots and self._queue_size >= self._max_queue_size
+
+    def _retry_after(self) -> str:
+        return str(max(1, math.ceil(self._hold_time)))
+
+    def _reject(self, reason: str) -> web.HTTPServiceUnavailable:
+        return web.HTTPServiceUnavailable(
+            reason=reason, headers={"Retry-After": self._retry_after()}
+        )
+
+    def _language(self, language: str) -> LanguageLimits:
+        if language not in self._languages:
+            self._languages[language] = LanguageLimits()
+
+        return self._languages[language]
+
+    def _fits(self, limits: LanguageLimits) -> bool:
+        if limits.full:
+            return False
+
+        # runs costing more than all slots are admitted alone
+        return self._used + limits.cost <= self._slots or not self._used
+
+    def _take(self, limits: LanguageLimits) -> None:
+        self._running += 1
+        self._used += limits.cost
+        limits.running += 1
+
+        self._virtual_time = max(self._virtual_time, limits.virtual_time)
+
+        # charged in advance with expected hold time, runs of the same language
+        # admitted at once are not all considered free
+        limits.virtual_time += limits.cost * limits.hold_time
+
+    def _free(self, limits: LanguageLimits) -> None:
+        self._running -= 1
+        self._used -= limits.cost
+        limits.running -= 1
+
+    async def acquire(self, priority: int = 0, language: str = "") -> float:
+        """Waits for free slot, returns time slot was acquired at."""
+
+        if self._closed:
+            raise self._reject("Runner is shutting down")
+
+        limits = self._language(language)
+
+        if not self._queue_size and self._fits(limits):
+            self._take(limits)
+            self._admitted += 1
+            limits.admitted += 1
+
+            return time.monotonic()
+
+        if self._queue_size >= self._max_queue_size:
+            self._rejected_full += 1
+
+            raise self._reject("No free containers. Try again later")
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+
+        if limits.head() is None and not limits.running:
+            limits.virtual_time = max(limits.virtual_time, self._virtual_time)
+
+        self._counter += 1
+        heapq.heappush(limits.waiters, (-priority, self._counter, waiter))
+
+        self._queue_size += 1
+        self._queued += 1
+        limits.queued += 1
+
+        # other languages might be blocked by per language limits
+        self._wake_up()
+
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=self._max_wait)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # slot was already passed to this waiter
+                self._free(limits)
+                self._wake_up()
+            else:
+                self._queue_size -= 1
+                waiter.cancel()
+
+            raise
+
+        if not waiter.done():
+            self._queue_size -= 1
+            waiter.cancel()
+
+        wait_time = time.monotonic() - started_at
+
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        limits.total_wait_time += wait_time
+        limits.max_wait_time = max(limits.max_wait_time, wait_time)
+
+        if waiter.cancelled():
+            if self._closed:
+                raise self._reject("Runner is shutting down")
+
+            self._rejected_timeout += 1
+
+            raise self._reject("Timed out waiting for free container")
+
+        self._admitted += 1
+        limits.admitted += 1
+
+        return time.monotonic()
+
+    def release(self, acquired_at: float, language: str = "") -> None:
+        hold_time = time.monotonic() - acquired_at
+        self._hold_time += (hold_time - self._hold_time) * HOLD_TIME_SMOOTHING
+
+        limits = self._language(language)
+        limits.hold_time += (hold_time - limits.hold_time) * HOLD_TIME_SMOOTHING
+        limits.slot_seconds += limits.cost * hold_time
+
+        self._free(limits)
+
+        self._wake_up()
+
+    def close(self) -> None:
+        """Rejects queued and new runs, running ones are not affected."""
+
+        self._closed = True
+
+        for limits in self._languages.values():
+            for _, _, waiter in limits.waiters:
+                if not waiter.done():
+                    self._queue_size -= 1
+                    waiter.cancel()
+
+            limits.waiters.clear()
+
+    def _wake_up(self) -> None:
+        while True:
+            best = None
+            best_key = None
+
+            for limits in self._languages.values():
+                if limits.full:
+                    continue
+
+                head = limits.head()
+                if head is None:
+                    continue
+
+                priority, counter, _ = head
+                key = (priority, limits.virtual_time, counter)
+                if best_key is None or key < best_key:
+                    best, best_key = limits, key
+
+            # cheaper languages do not overtake waiter that does not fit yet,
+            # otherwise costly runs could wait forever
+            if best is None or not self._fits(best):
+                return
+
+            _, _, waiter = heapq.heappop(best.waiters)
+
+            # slot is passed to waiter directly
+            self._take(best)
+            self._queue_size -= 1
+
+            waiter.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            running=self._running,
+            used=self._used,
+            slots=self._slots,
+            closed=self._closed,
+            queue_size=self.queue_size,
+            max_queue_size=self._max_queue_size,
+            max_wait=self._max_wait,
+            admitted=self._admitted,
+            queued=self._queued,
+            rejected_full=self._rejected_full,
+            rejected_timeout=self._rejected_timeout,
+            average_wait_time=self._total_wait_time / self._queued
+            if self._queued
+            else 0,
+            max_wait_time=self._max_wait_time,
+            languages={
+                language: limits.stats(self._slots)
+                for language, limits in self._languages.items()
+            },
+        )
@@ -0,0 +1,184 @@
+import json
+import time
+import socket
+import asyncio
+import logging
+
+from copy import copy
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Optional, Sequence
+
+import aioredis
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "run-node:"
+
+# node id -> expiration timestamp, used to list nodes without scanning keys
+REDIS_NODES_KEY = "run-nodes"
+
+HEARTBEAT_INTERVAL = 5
+
+# seconds node is considered alive after last heartbeat
+HEARTBEAT_TTL = 15
+
+
+def node_id(config: Dict[str, Any]) -> str:
+    return config["app"].get("node-id") or socket.gethostname()
+
+
+def pick_node(
+    nodes: Sequence[Dict[str, Any]], language: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Returns least loaded node, nodes with language image and warm containers are
+    preferred. Returns None if all nodes are full.
+    """
+
+    available = [
+        node
+        for node in nodes
+        if not node["draining"]
+        and (node["free_slots"] > 0 or node["queue_size"] < node["max_queue_size"])
+    ]
+    if not available:
+        return None
+
+    return min(
+        available,
+        key=lambda node: (
+            language not in node["images"],
+            node["free_slots"] == 0,
+            not node["warm_pool"].get(language),
+            node["queue_size"] - node["free_slots"],
+        ),
+    )
+
+
+class CapacityAdvertiser:
+    """Publishes capacity of runner to redis and reads capacity of other nodes."""
+
+    def __init__(
+        self,
+        runner: "DockerRunner",
+        node_id: str,
+        url: Optional[str],
+        address: Tuple[str, int],
+        interval: float = HEARTBEAT_INTERVAL,
+        ttl: float = HEARTBEAT_TTL,
+        **kwargs: Any,
+    ):
+        self._runner = runner
+        self._node_id = node_id
+        self._url = url
+        self._address = address
+        self._interval = interval
+        self._ttl = ttl
+        self._kwargs = kwargs
+
+        self._redis: aioredis.Redis
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        log.debug("creating capacity redis connection")
+
+        self._redis = await aioredis.create_redis_pool(self._address, **self._kwargs)
+
+        self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+        try:
+            await asyncio.gather(
+                self._redis.zrem(REDIS_NODES_KEY, self._node_id),
+                self._redis.delete(f"{REDIS_KEY_PREFIX}{self._node_id}"),
+            )
+        except (aioredis.RedisError, OSError) as e:
+            log.error(f"unable to remove node from redis: {e}")
+
+        log.debug("closing capacity redis connection")
+
+        self._redis.close()
+        await self._redis.wait_closed()
+
+    async def heartbeat(self) -> None:
+        capacity = await self._runner.capacity()
+        capacity.update(id=self._node_id, url=self._url, updated_at=time.time())
+
+        await asyncio.gather(
+            self._redis.set(
+                f"{REDIS_KEY_PREFIX}{self._node_id}",
+                json.dumps(capacity),
+                pexpire=int(self._ttl * 1000),
+            ),
+            self._redis.zadd(REDIS_NODES_KEY, time.time() + self._ttl, self._node_id),
+        )
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            try:
+                await self.heartbeat()
+            except (aioredis.RedisError, OSError) as e:
+                log.error(f"unable to publish capacity: {e}")
+            except web.HTTPException:  # docker error, already logged
+                pass
+
+            await asyncio.sleep(self._interval)
+
+    async def nodes(self) -> List[Dict[str, Any]]:
+        """Returns capacity of alive nodes, including this one."""
+
+        await self._redis.zremrangebyscore(REDIS_NODES_KEY, max=time.time())
+
+        node_ids = await self._redis.zrange(REDIS_NODES_KEY, encoding="utf-8")
+        if not node_ids:
+            return []
+
+        values = await self._redis.mget(
+            *(f"{REDIS_KEY_PREFIX}{node_id}" for node_id in node_ids),
+            encoding="utf-8",
+        )
+
+        return [json.loads(value) for value in values if value is not None]
+
+
+async def on_startup(app: web.Application) -> None:
+    config = app["config"]
+
+    redis_config = copy(config["redis-rpc"])
+
+    host = redis_config.pop("host")
+    port = redis_config.pop("port")
+
+    advertiser = CapacityAdvertiser(
+        app["runner"],
+        node_id(config),
+        config["app"].get("node-url"),
+        (host, port),
+        config["app"].get("capacity-interval", HEARTBEAT_INTERVAL),
+        config["app"].get("capacity-ttl", HEARTBEAT_TTL),
+        **redis_config,
+    )
+    await advertiser.start()
+
+    app["capacity"] = advertiser
+
+
+async def on_shutdown(app: web.Application) -> None:
+    await app["capacity"].close()
+
+
+def setup(app: web.Application) -> None:
+    """Should be called after runner setup is added to startup signal."""
+
+    if not app["config"]["app"].get("advertise-capacity", False):
+        return
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
@@ -0,0 +1,86 @@
+import time
+import asyncio
+
+from typing import Any, Dict, Tuple, Callable, Hashable, Awaitable
+
+from aiohttp import web
+
+
+class _Call:
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.started_at = time.monotonic()
+        self.waiters = 0
+
+
+class Coalescer:
+    """
+    Lets identical concurrent calls share result of one execution.
+
+    Call joins execution with the same key if it started less than window seconds
+    ago. Execution is cancelled when all callers waiting for it are cancelled.
+    """
+
+    def __init__(self, window: float):
+        self._window = window
+
+        self._calls: Dict[Hashable, _Call] = {}
+
+        self._executions = 0
+        self._coalesced = 0
+
+    async def run(
+        self, key: Hashable, func: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Returns result of func and whether it was taken from other call."""
+
+        call = self._calls.get(key)
+        coalesced = (
+            call is not None and time.monotonic() - call.started_at <= self._window
+        )
+
+        if call is None or not coalesced:
+            call = self._start(key, func)
+
+            self._executions += 1
+        else:
+            self._coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), coalesced
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+
+            raise
+        except web.HTTPException as e:
+            if not coalesced:
+                raise
+
+            # aiohttp responds with raised exception, each caller needs a copy
+            raise e.__class__(reason=e.reason, headers=e.headers) from e
+        finally:
+            call.waiters -= 1
+
+    def _start(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> _Call:
+        call = _Call(asyncio.ensure_future(func()))
+
+        def forget(_: "asyncio.Future[Any]") -> None:
+            # call could be replaced by newer one after window passed
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+        call.task.add_done_callback(forget)
+
+        self._calls[key] = call
+
+        return call
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            window=self._window,
+            in_flight=len(self._calls),
+            executions=self._executions,
+            coalesced=self._coalesced,
+        )
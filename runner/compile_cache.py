@@ -0,0 +1,132 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class CompileCache:
+    """Stores compiled binaries on disk, evicts least recently used ones."""
+
+    def __init__(self, path: str, max_size: int):
+        self._path = path
+        self._max_size = max_size
+
+        # key -> file size, ordered from least to most recently used
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+
+        self._hits = 0
+        self._misses = 0
+
+    def load(self) -> None:
+        os.makedirs(self._path, exist_ok=True)
+
+        files = []
+        for entry in os.scandir(self._path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+        log.debug("loaded %d compiled binaries from disk", len(self._entries))
+
+        self._evict()
+
+    @staticmethod
+    def make_key(image_id: str, compile_commands: List[str], code: str) -> str:
+        digest = hashlib.sha256()
+        for part in (image_id, *compile_commands, code):
+            digest.update(part.encode())
+            digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if key not in self._entries:
+            self._misses += 1
+
+            return None
+
+        self._entries.move_to_end(key)
+
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, self._read, key
+            )
+        except OSError as e:
+            log.error(f"unable to read compiled binary {key}: {e}")
+
+            self._forget(key)
+            self._misses += 1
+
+            return None
+
+        self._hits += 1
+
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        if len(data) > self._max_size:
+            return
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write, key, data)
+
+        if key in self._entries:
+            self._forget(key)
+
+        self._entries[key] = len(data)
+        self._size += len(data)
+
+        self._evict()
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self._path, key)
+
+    def _read(self, key: str) -> bytes:
+        path = self._file_path(key)
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        # mtime is used to restore usage order after restart
+        os.utime(path)
+
+        return data
+
+    def _write(self, key: str, data: bytes) -> None:
+        tmp_path = f"{self._file_path(key)}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp_path, self._file_path(key))
+
+    def _forget(self, key: str) -> None:
+        self._size -= self._entries.pop(key)
+
+    def _evict(self) -> None:
+        while self._size > self._max_size:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+
+            try:
+                os.remove(self._file_path(key))
+            except OSError as e:
+                log.error(f"unable to remove compiled binary {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            hits=self._hits,
+            misses=self._misses,
+            entries=len(self._entries),
+            size=self._size,
+            max_size=self._max_size,
+        )
@@ -0,0 +1,170 @@
+import os
+import math
+import time
+import logging
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+NODE_ROOT = "/sys/devices/system/node"
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """Parses cpu list in cpuset format, like 0-3,8."""
+
+    cpus: List[int] = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    return ",".join(map(str, cpus))
+
+
+def numa_nodes() -> Dict[int, int]:
+    """Returns cpu -> numa node of this host, empty if kernel does not report them."""
+
+    nodes = {}
+    try:
+        names = os.listdir(NODE_ROOT)
+    except OSError:
+        return {}
+
+    for name in names:
+        if not name.startswith("node") or not name[4:].isdigit():
+            continue
+
+        try:
+            with open(os.path.join(NODE_ROOT, name, "cpulist")) as f:
+                cpus = parse_cpu_list(f.read())
+        except (OSError, ValueError):
+            continue
+
+        for cpu in cpus:
+            nodes[cpu] = int(name[4:])
+
+    return nodes
+
+
+class CpuSlot:
+    def __init__(self, cpus: Sequence[int], mems: Optional[str]):
+        self.cpus = format_cpu_list(cpus)
+        self.mems = mems
+
+        self.runs = 0
+        self.busy_time = 0.0
+        self.acquired_at: Optional[float] = None
+
+        # running mean and sum of squared deviations of exec time, Welford's method
+        self._exec_count = 0
+        self._exec_mean = 0.0
+        self._exec_m2 = 0.0
+
+    def observe_exec_time(self, exec_time: float) -> None:
+        self._exec_count += 1
+
+        delta = exec_time - self._exec_mean
+        self._exec_mean += delta / self._exec_count
+        self._exec_m2 += delta * (exec_time - self._exec_mean)
+
+    def stats(self, uptime: float) -> Dict[str, Any]:
+        busy_time = self.busy_time
+        if self.acquired_at is not None:
+            busy_time += time.monotonic() - self.acquired_at
+
+        return dict(
+            cpus=self.cpus,
+            mems=self.mems,
+            busy=self.acquired_at is not None,
+            runs=self.runs,
+            utilization=busy_time / uptime if uptime else 0,
+            avg_exec_time=self._exec_mean if self._exec_count else None,
+            stddev_exec_time=math.sqrt(self._exec_m2 / (self._exec_count - 1))
+            if self._exec_count > 1
+            else None,
+        )
+
+
+class CpuSlots:
+    """
+    Gives each running container dedicated cpus.
+
+    Cpus are split into slots of cpus_per_slot cpus, remainder is not used. With numa
+    slots do not cross node boundaries and containers are limited to memory of their
+    node. Numa topology is read from this host, docker should run on it.
+    """
+
+    def __init__(self, cpus: Sequence[int], cpus_per_slot: int, numa: bool = False):
+        nodes = numa_nodes() if numa else {}
+
+        groups: Dict[Optional[int], List[int]] = {}
+        for cpu in sorted(cpus):
+            groups.setdefault(nodes.get(cpu), []).append(cpu)
+
+        self._slots = []
+        for node, group in groups.items():
+            for i in range(0, len(group) - cpus_per_slot + 1, cpus_per_slot):
+                self._slots.append(
+                    CpuSlot(
+                        group[i : i + cpus_per_slot],
+                        None if node is None else str(node),
+                    )
+                )
+
+        if not self._slots:
+            raise ValueError(
+                f"Not enough cpus for slot of {cpus_per_slot}: {format_cpu_list(cpus)}"
+            )
+
+        # most recently released slot is taken first, its caches are warm
+        self._free = list(reversed(self._slots))
+
+        self._created_at = time.monotonic()
+
+        log.info("cpu slots: %s", " ".join(f"[{slot.cpus}]" for slot in self._slots))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def acquire(self) -> CpuSlot:
+        # admission allows at most as many runs as there are slots
+        if not self._free:
+            raise web.HTTPServiceUnavailable(reason="No free cpu slots")
+
+        slot = self._free.pop()
+        slot.acquired_at = time.monotonic()
+
+        return slot
+
+    def release(self, slot: CpuSlot) -> float:
+        """Returns time slot was busy for."""
+
+        assert slot.acquired_at is not None
+
+        busy_time = time.monotonic() - slot.acquired_at
+
+        slot.runs += 1
+        slot.busy_time += busy_time
+        slot.acquired_at = None
+
+        self._free.append(slot)
+
+        return busy_time
+
+    def stats(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self._created_at
+
+        return dict(
+            free=len(self._free),
+            slots=[slot.stats(uptime) for slot in self._slots],
+        )
@@ -0,0 +1,284 @@
+import math
+import time
+import asyncio
+import logging
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    Callable,
+    Optional,
+    Sequence,
+    Awaitable,
+)
+
+import aiohttp
+
+from aiohttp import web
+
+from .metrics import Metrics
+from .capacity import pick_node
+
+if TYPE_CHECKING:
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+PROBE_INTERVAL = 5
+PROBE_TIMEOUT = 5
+
+# consecutive failed probes after which endpoint is taken out of rotation
+PROBE_FAILURES = 3
+
+
+class _Host:
+    def __init__(self, runner: "DockerRunner"):
+        self.runner = runner
+
+        # endpoints are in rotation until proven otherwise, probe runs on setup
+        self.healthy = True
+        self.failures = 0
+        self.images: List[str] = []
+
+        self.probed_at: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.error: Optional[str] = None
+
+        self.runs = 0
+
+    def node(self, index: int) -> Dict[str, Any]:
+        return dict(self.runner.load(), id=index, images=self.images)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            endpoint=self.runner.endpoint,
+            healthy=self.healthy,
+            failures=self.failures,
+            languages=self.images,
+            probed_at=self.probed_at,
+            probe_latency=self.latency,
+            probe_error=self.error,
+            runs=self.runs,
+            **self.runner.stats(),
+        )
+
+
+class MultiHostRunner:
+    """
+    Places runs on set of docker endpoints, each with own runner.
+
+    Run goes to endpoint with free capacity that has language image, endpoints with
+    warm containers of language are preferred. Endpoints are probed periodically,
+    failing ones are taken out of rotation until probe succeeds.
+    """
+
+    def __init__(
+        self,
+        runners: Sequence["DockerRunner"],
+        metrics: Metrics,
+        probe_interval: float = PROBE_INTERVAL,
+        probe_timeout: float = PROBE_TIMEOUT,
+        probe_failures: int = PROBE_FAILURES,
+    ):
+        self._hosts = [_Host(runner) for runner in runners]
+        self.metrics = metrics
+
+        self._probe_interval = probe_interval
+        self._probe_timeout = probe_timeout
+        self._probe_failures = probe_failures
+
+        self._probe_task: Optional["asyncio.Task[None]"] = None
+
+    async def setup(self) -> None:
+        await asyncio.gather(*(host.runner.setup() for host in self._hosts))
+        await self.probe()
+
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def close(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+
+        await asyncio.gather(*(host.runner.close() for host in self._hosts))
+
+    def _fail(self, host: _Host, e: BaseException) -> None:
+        host.failures += 1
+        host.error = repr(e)
+
+        if host.healthy and host.failures >= self._probe_failures:
+            log.warning(f"endpoint {host.runner.endpoint} taken out of rotation: {e!r}")
+
+            host.healthy = False
+
+    async def _probe(self, host: _Host) -> None:
+        started_at = time.monotonic()
+        try:
+            host.images = await asyncio.wait_for(
+                host.runner.languages(), self._probe_timeout
+            )
+        except (
+            web.HTTPException,
+            aiohttp.ClientError,
+            OSError,
+            asyncio.TimeoutError,
+        ) as e:
+            self._fail(host, e)
+        else:
+            if not host.healthy:
+                log.info(f"endpoint {host.runner.endpoint} is back in rotation")
+
+            host.healthy = True
+            host.failures = 0
+            host.error = None
+        finally:
+            host.probed_at = time.time()
+            host.latency = time.monotonic() - started_at
+
+    async def probe(self) -> None:
+        await asyncio.gather(*map(self._probe, self._hosts))
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._probe_interval)
+            await self.probe()
+
+    def _reject(self, reason: str) -> web.HTTPServiceUnavailable:
+        # health and images of endpoints are updated by probes
+        return web.HTTPServiceUnavailable(
+            reason=reason,
+            headers={"Retry-After": str(max(1, math.ceil(self._probe_interval)))},
+        )
+
+    def _place(self, language: str) -> _Host:
+        nodes = [host.node(i) for i, host in enumerate(self._hosts) if host.healthy]
+        if not nodes:
+            raise self._reject("No healthy docker endpoints")
+
+        node = pick_node(nodes, language)
+        if node is None:
+            raise self._reject("No free containers")
+
+        host = self._hosts[node["id"]]
+        host.runs += 1
+
+        return host
+
+    async def run_code(self, language: str, **kwargs: Any) -> Dict[str, Any]:
+        host = self._place(language)
+        try:
+            return await host.runner.run_code(language, **kwargs)
+        except (aiohttp.ClientError, OSError) as e:
+            self._fail(host, e)
+
+            raise web.HTTPServiceUnavailable(reason="Docker endpoint is unavailable")
+
+    async def run_batch(self, language: str, **kwargs: Any) -> Dict[str, Any]:
+        host = self._place(language)
+        try:
+            return await host.runner.run_batch(language, **kwargs)
+        except (aiohttp.ClientError, OSError) as e:
+            self._fail(host, e)
+
+            raise web.HTTPServiceUnavailable(reason="Docker endpoint is unavailable")
+
+    @property
+    def busy(self) -> bool:
+        return all(host.runner.busy for host in self._hosts if host.healthy)
+
+    @property
+    def max_containers(self) -> int:
+        return sum(host.runner.max_containers for host in self._hosts)
+
+    @property
+    def draining(self) -> bool:
+        return all(host.runner.draining for host in self._hosts)
+
+    async def drain(self, timeout: float) -> None:
+        await asyncio.gather(*(host.runner.drain(timeout) for host in self._hosts))
+
+    async def pull_image(self, language: str) -> Dict[str, Any]:
+        return await self._on_healthy(lambda runner: runner.pull_image(language))
+
+    async def pull_images(
+        self, languages: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+        return await self._on_healthy(lambda runner: runner.pull_images(languages))
+
+    async def _on_healthy(
+        self, func: Callable[["DockerRunner"], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Returns results of func on healthy endpoints by endpoint."""
+
+        hosts = [host for host in self._hosts if host.healthy]
+
+        results = await asyncio.gather(
+            *(func(host.runner) for host in hosts), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(
+                result, (web.HTTPException, aiohttp.ClientError, OSError)
+            ):
+                raise result
+
+        return {
+            host.runner.endpoint: dict(error=str(result))
+            if isinstance(result, BaseException)
+            else result
+            for host, result in zip(hosts, results)
+        }
+
+    def load(self) -> Dict[str, Any]:
+        """Sums load of healthy endpoints."""
+
+        load: Dict[str, Any] = dict(
+            free_slots=0,
+            slots=0,
+            draining=self.draining,
+            queue_size=0,
+            max_queue_size=0,
+            warm_pool={},
+        )
+        for host in self._hosts:
+            if not host.healthy:
+                continue
+
+            host_load = host.runner.load()
+            for key in ("free_slots", "slots", "queue_size", "max_queue_size"):
+                load[key] += host_load[key]
+
+            for language, ready in host_load["warm_pool"].items():
+                load["warm_pool"][language] = load["warm_pool"].get(language, 0) + ready
+
+        return load
+
+    async def languages(self) -> List[str]:
+        return sorted(
+            {
+                language
+                for host in self._hosts
+                if host.healthy
+                for language in host.images
+            }
+        )
+
+    async def capacity(self) -> Dict[str, Any]:
+        return dict(self.load(), images=await self.languages())
+
+    @property
+    def running(self) -> int:
+        return sum(host.runner.running for host in self._hosts)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            running_containers=self.running,
+            max_containers=self.max_containers,
+            endpoints=[host.stats() for host in self._hosts],
+        )
+
+    def render_metrics(self) -> str:
+        self.metrics.running_containers.set(value=self.running)
+        self.metrics.max_containers.set(value=self.max_containers)
+
+        return self.metrics.render()
@@ -0,0 +1,274 @@
+import time
+import asyncio
+import logging
+
+from json import dumps, loads
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence
+
+import aiohttp
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+IMAGE_TAG = "latest"
+
+PULL_CONCURRENCY = 2
+
+# seconds without pull progress after which pull fails, pull itself is not limited
+PULL_READ_TIMEOUT = 300
+
+PULL_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_read=PULL_READ_TIMEOUT)
+
+# layer statuses after which layer is not downloaded anymore
+LAYER_DONE_STATUSES = ("Download complete", "Pull complete", "Already exists")
+
+
+class ImageManager:
+    """
+    Pulls language images over docker api and keeps index of their digests.
+
+    Concurrent pulls of one language share one pull, number of simultaneous pulls is
+    bounded. When pulled image differs from indexed one, cached image information and
+    warm containers of language are dropped and optionally one no-op container is run
+    so that first real run does not start from cold image.
+    """
+
+    def __init__(
+        self,
+        runner: "DockerRunner",
+        concurrency: int = PULL_CONCURRENCY,
+        prewarm: bool = False,
+    ):
+        self._runner = runner
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._prewarm = prewarm
+
+        # language -> id, digest and pull time of image
+        self._index: Dict[str, Dict[str, Any]] = {}
+
+        self._pulls: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+
+        # language -> layers and bytes of pull in progress
+        self._progress: Dict[str, Dict[str, Any]] = {}
+
+        self._pulled = 0
+        self._updated = 0
+        self._failed = 0
+        self._prewarmed = 0
+
+    @staticmethod
+    def _entry(image: Dict[str, Any]) -> Dict[str, Any]:
+        digests = image.get("RepoDigests") or ()
+
+        return dict(id=image["Id"], digest=digests[0] if digests else None)
+
+    async def present(self) -> Dict[str, Dict[str, Any]]:
+        """Returns language -> image of language images present on docker host."""
+
+        images = await self._runner.docker_request(
+            "GET",
+            "images/json",
+            {"filters": dumps({"reference": [self._runner.image_name("*")]})},
+        )
+
+        present: Dict[str, Dict[str, Any]] = {}
+
+        prefix = self._runner.image_name("")
+        for image in images:
+            for tag in image.get("RepoTags") or ():
+                if tag.startswith(prefix):
+                    present.setdefault(tag[len(prefix) :].split(":")[0], image)
+
+        return present
+
+    async def refresh(self) -> None:
+        """Indexes language images present on docker host."""
+
+        for language, image in (await self.present()).items():
+            self._index.setdefault(language, self._entry(image))
+
+    async def pull(self, language: str) -> Dict[str, Any]:
+        task = self._pulls.get(language)
+        if task is None:
+            task = self._pulls[language] = asyncio.create_task(self._pull(language))
+
+            task.add_done_callback(lambda _: self._pulls.pop(language, None))
+
+        # pull is not cancelled with one of waiting callers
+        return await asyncio.shield(task)
+
+    async def pull_all(
+        self, languages: Optional[Sequence[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """Pulls images in parallel, all present on docker host by default."""
+
+        if languages is None:
+            await self.refresh()
+
+            languages = sorted(self._index)
+
+        async def pull(language: str) -> Dict[str, Any]:
+            try:
+                return await self.pull(language)
+            except (web.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return dict(language=language, error=str(e))
+
+        results = await asyncio.gather(*map(pull, languages))
+
+        return dict(zip(languages, results))
+
+    async def _pull(self, language: str) -> Dict[str, Any]:
+        image_name = self._runner.image_name(language)
+
+        async with self._semaphore:
+            log.info(f"pulling {image_name}")
+
+            started_at = time.monotonic()
+
+            progress = self._progress[language] = dict(
+                started_at=time.time(), layers={}, current=0, total=0
+            )
+            try:
+                await self._stream_pull(image_name, progress)
+            except (web.HTTPException, aiohttp.ClientError, asyncio.TimeoutError):
+                self._failed += 1
+
+                raise
+            finally:
+                del self._progress[language]
+
+            pull_time = time.monotonic() - started_at
+
+        self._pulled += 1
+        self._runner.metrics.image_pull_seconds.observe(pull_time, language)
+
+        entry = self._entry(
+            await self._runner.docker_request("GET", f"images/{image_name}/json")
+        )
+
+        previous = self._index.get(language)
+        updated = previous is None or previous["id"] != entry["id"]
+
+        self._index[language] = dict(entry, pulled_at=time.time())
+
+        if updated:
+            log.info(f"{image_name} updated to {entry['digest'] or entry['id']}")
+
+            self._updated += 1
+            self._runner.forget_image(language)
+
+        prewarmed = False
+        if updated and self._prewarm:
+            try:
+                await self.prewarm(language)
+            except web.HTTPException:  # already logged by docker_request
+                pass
+            else:
+                prewarmed = True
+
+        return dict(
+            language=language,
+            id=entry["id"],
+            digest=entry["digest"],
+            updated=updated,
+            prewarmed=prewarmed,
+            pull_time=pull_time,
+        )
+
+    async def _stream_pull(self, image_name: str, progress: Dict[str, Any]) -> None:
+        """Reads newline separated progress events, errors are reported in events."""
+
+        async with self._runner.docker_stream(
+            "POST",
+            "images/create",
+            {"fromImage": image_name, "tag": IMAGE_TAG},
+            observe_latency=False,
+            timeout=PULL_TIMEOUT,
+        ) as resp:
+            assert resp is not None
+
+            async for line in resp.content:
+                if not line.strip():
+                    continue
+
+                event = loads(line)
+
+                if "error" in event:
+                    log.error(f"pull of {image_name} failed: {event['error']}")
+
+                    raise web.HTTPInternalServerError(
+                        reason=f"Pull of {image_name} failed: {event['error']}"
+                    )
+
+                layer = event.get("id")
+                if layer is None or "status" not in event:
+                    continue
+
+                # completion events do not repeat sizes
+                layers = progress["layers"]
+                layers[layer] = dict(
+                    layers.get(layer, {}),
+                    status=event["status"],
+                    **(event.get("progressDetail") or {}),
+                )
+
+                progress["current"] = sum(
+                    detail.get("current", 0) for detail in layers.values()
+                )
+                progress["total"] = sum(
+                    detail.get("total", 0) for detail in layers.values()
+                )
+
+    async def prewarm(self, language: str) -> None:
+        """Runs no-op container, image layers are loaded and container is set up."""
+
+        started_at = time.monotonic()
+
+        config = self._runner.container_config(language, [])
+        config["Entrypoint"] = ["true"]
+        config["Cmd"] = []
+
+        create_result = await self._runner.docker_request(
+            "POST", "containers/create", body=config
+        )
+        container_id = create_result["Id"]
+
+        try:
+            await self._runner.docker_request(
+                "POST", f"containers/{container_id}/start"
+            )
+            await self._runner.docker_request(
+                "POST", f"containers/{container_id}/wait", observe_latency=False
+            )
+        finally:
+            self._runner.schedule_removal(container_id, language)
+
+        self._prewarmed += 1
+
+        log.debug(f"prewarmed {language} in {time.monotonic() - started_at:.3f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            index=self._index,
+            pulling={
+                language: dict(
+                    started_at=progress["started_at"],
+                    layers=len(progress["layers"]),
+                    layers_done=sum(
+                        layer["status"] in LAYER_DONE_STATUSES
+                        for layer in progress["layers"].values()
+                    ),
+                    current=progress["current"],
+                    total=progress["total"],
+                )
+                for language, progress in self._progress.items()
+            },
+            pulled=self._pulled,
+            updated=self._updated,
+            failed=self._failed,
+            prewarmed=self._prewarmed,
+        )
@@ -0,0 +1,289 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+from copy import copy
+from typing import TYPE_CHECKING, Any, Set, Dict, Tuple, Optional
+
+import aioredis
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+# list of queued jobs, pushed to the left and popped from the right
+REDIS_QUEUE_KEY = "run-jobs"
+
+REDIS_KEY_PREFIX = "run-job:"
+
+# job ids are published here when job finishes
+REDIS_CHANNEL = "run-jobs-finished"
+
+JOB_TTL = 600
+
+JOB_QUEUE_SIZE = 1000
+
+# max seconds GET request waits for job to finish
+MAX_WAIT = 30
+
+# seconds blocking pop waits before checking for cancellation
+POP_TIMEOUT = 5
+
+# seconds to wait before taking next job after runner rejected job
+REQUEUE_DELAY = 1
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+
+class JobQueue:
+    """
+    Runs code asynchronously. Jobs are queued in redis and can be taken by any node.
+
+    Job is lost if node running it stops, it stays running until it expires.
+    """
+
+    def __init__(
+        self,
+        runner: "DockerRunner",
+        address: Tuple[str, int],
+        ttl: float = JOB_TTL,
+        max_queue_size: int = JOB_QUEUE_SIZE,
+        concurrency: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        self._runner = runner
+        self._address = address
+        self._ttl = ttl
+        self._max_queue_size = max_queue_size
+        self._kwargs = kwargs
+
+        # limits jobs taken by this node, runs are queued by runner otherwise
+        self._semaphore = asyncio.Semaphore(
+            runner.max_containers if concurrency is None else concurrency
+        )
+
+        self._waiters: Dict[str, Set["asyncio.Future[None]"]] = {}
+
+        self._jobs: Set["asyncio.Task[None]"] = set()
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+        self._redis: aioredis.Redis
+        # blocking pop and subscription take connection for long time
+        self._blocking_redis: aioredis.Redis
+        self._subscriber: aioredis.Redis
+
+    async def start(self) -> None:
+        log.debug("creating job queue redis connections")
+
+        self._redis = await aioredis.create_redis_pool(self._address, **self._kwargs)
+        self._blocking_redis = await aioredis.create_redis(
+            self._address, **self._kwargs
+        )
+        self._subscriber = await aioredis.create_redis(self._address, **self._kwargs)
+
+        (channel,) = await self._subscriber.subscribe(REDIS_CHANNEL)
+
+        self._tasks = {
+            asyncio.create_task(self._listen(channel)),
+            asyncio.create_task(self._take_jobs()),
+        }
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        # jobs already taken are finished
+        if self._jobs:
+            await asyncio.wait(self._jobs)
+
+        log.debug("closing job queue redis connections")
+
+        for redis in (self._redis, self._blocking_redis, self._subscriber):
+            redis.close()
+            await redis.wait_closed()
+
+    async def submit(self, request: Dict[str, Any]) -> str:
+        """Queues run_code keyword arguments, returns job id."""
+
+        if await self._redis.llen(REDIS_QUEUE_KEY) >= self._max_queue_size:
+            raise web.HTTPServiceUnavailable(reason="Job queue is full")
+
+        job_id = uuid.uuid4().hex
+
+        await self._set(job_id, dict(status=STATUS_QUEUED, created_at=time.time()))
+        await self._redis.lpush(
+            REDIS_QUEUE_KEY, json.dumps(dict(id=job_id, request=request))
+        )
+
+        return job_id
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Returns job, waits up to wait seconds for it to finish."""
+
+        job = await self._get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or wait <= 0:
+            return job
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, set()).add(waiter)
+
+        try:
+            # job could finish before waiter was added
+            job = await self._get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                return job
+
+            await asyncio.wait({waiter}, timeout=wait)
+        finally:
+            waiters = self._waiters[job_id]
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[job_id]
+
+        return await self._get(job_id)
+
+    async def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        value = await self._redis.get(f"{REDIS_KEY_PREFIX}{job_id}")
+        if value is None:
+            return None
+
+        return dict(json.loads(value), id=job_id)
+
+    async def _set(self, job_id: str, job: Dict[str, Any]) -> None:
+        await self._redis.set(
+            f"{REDIS_KEY_PREFIX}{job_id}",
+            json.dumps(job),
+            pexpire=int(self._ttl * 1000),
+        )
+
+    async def _listen(self, channel: aioredis.Channel) -> None:
+        async for job_id in channel.iter(encoding="utf-8"):
+            for waiter in self._waiters.get(job_id, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def _take_jobs(self) -> None:
+        while True:
+            if self._runner.draining:
+                # jobs are left for other nodes
+                await asyncio.sleep(REQUEUE_DELAY)
+
+                continue
+
+            await self._semaphore.acquire()
+
+            try:
+                value = await self._blocking_redis.brpop(
+                    REDIS_QUEUE_KEY, timeout=POP_TIMEOUT
+                )
+            except (aioredis.RedisError, OSError) as e:
+                log.error(f"unable to take job: {e}")
+
+                value = None
+                await asyncio.sleep(REQUEUE_DELAY)
+
+            if value is None:
+                self._semaphore.release()
+
+                continue
+
+            _, raw_job = value
+
+            task = asyncio.create_task(self._run(raw_job))
+            task.add_done_callback(self._jobs.discard)
+
+            self._jobs.add(task)
+
+    async def _run(self, raw_job: bytes) -> None:
+        job = json.loads(raw_job)
+        job_id = job["id"]
+
+        try:
+            created_at = (await self._get(job_id) or {}).get("created_at")
+
+            await self._set(
+                job_id,
+                dict(
+                    status=STATUS_RUNNING, created_at=created_at, started_at=time.time()
+                ),
+            )
+
+            try:
+                result = await self._runner.run_code(**job["request"])
+            except web.HTTPServiceUnavailable:
+                log.debug("runner is busy, requeueing job %s", job_id)
+
+                await self._set(
+                    job_id, dict(status=STATUS_QUEUED, created_at=created_at)
+                )
+                await self._redis.rpush(REDIS_QUEUE_KEY, raw_job)
+                await asyncio.sleep(REQUEUE_DELAY)
+
+                return
+            except web.HTTPException as e:
+                finished: Dict[str, Any] = dict(
+                    status=STATUS_FAILED, error=dict(status=e.status, reason=e.reason)
+                )
+            except Exception:
+                log.exception(f"job {job_id} failed")
+
+                finished = dict(
+                    status=STATUS_FAILED,
+                    error=dict(status=500, reason="Internal server error"),
+                )
+            else:
+                finished = dict(status=STATUS_DONE, result=result)
+
+            await self._set(
+                job_id, dict(finished, created_at=created_at, finished_at=time.time())
+            )
+            await self._redis.publish(REDIS_CHANNEL, job_id)
+        except (aioredis.RedisError, OSError) as e:
+            log.error(f"unable to update job {job_id}: {e}")
+        finally:
+            self._semaphore.release()
+
+
+async def on_startup(app: web.Application) -> None:
+    config = app["config"]
+
+    redis_config = copy(config["redis-rpc"])
+
+    host = redis_config.pop("host")
+    port = redis_config.pop("port")
+
+    jobs = JobQueue(
+        app["runner"],
+        (host, port),
+        config["app"].get("job-ttl", JOB_TTL),
+        config["app"].get("job-queue-size", JOB_QUEUE_SIZE),
+        config["app"].get("job-concurrency"),
+        **redis_config,
+    )
+    await jobs.start()
+
+    app["jobs"] = jobs
+
+
+async def on_shutdown(app: web.Application) -> None:
+    await app["jobs"].close()
+
+
+def setup(app: web.Application) -> None:
+    """Should be called after runner setup is added to startup signal."""
+
+    if not app["config"]["app"].get("jobs", False):
+        return
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
@@ -0,0 +1,232 @@
+import time
+import bisect
+
+from typing import Dict, List, Tuple, Iterator, Sequence
+from contextlib import contextmanager
+
+# seconds
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+# bytes
+SIZE_BUCKETS = tuple(1 << (2 * i) for i in range(11))
+
+# bytes, 1 MiB to 4 GiB
+MEMORY_BUCKETS = tuple(1 << (20 + i) for i in range(13))
+
+# seconds
+PULL_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+_Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+
+        for name, labels, value in self._samples():
+            yield f"{name}{labels} {_format_value(value)}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+
+        self._values: Dict[_Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+
+        self._buckets = tuple(buckets)
+
+        # labels -> (non cumulative bucket counts, sum of observed values)
+        self._values: Dict[_Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self._buckets) + 1), [0.0])
+
+        counts, total = entry
+
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observes duration of block. Nothing is observed if block raises."""
+
+        started_at = time.monotonic()
+
+        yield
+
+        self.observe(time.monotonic() - started_at, *labels)
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        label_names = (*self.labels, "le")
+
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self._buckets, float("inf")), counts):
+                cumulative += count
+
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(label_names, (*labels, _format_value(bound))),
+                    cumulative,
+                )
+
+            formatted_labels = _format_labels(self.labels, labels)
+
+            yield f"{self.name}_sum", formatted_labels, total[0]
+            yield f"{self.name}_count", formatted_labels, cumulative
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.docker_phase_seconds = Histogram(
+            "runner_docker_phase_seconds",
+            "Duration of docker api calls made during run",
+            ("phase", "language"),
+        )
+        self.runs = Counter("runner_runs_total", "Finished runs", ("language",))
+        self.timeouts = Counter(
+            "runner_timeouts_total", "Runs killed by timeout", ("language",)
+        )
+        self.output_limit_kills = Counter(
+            "runner_output_limit_kills_total",
+            "Runs killed for exceeding output limit",
+            ("language",),
+        )
+        self.coalesced_runs = Counter(
+            "runner_coalesced_runs_total",
+            "Runs that received result of identical concurrent run",
+            ("language",),
+        )
+        self.docker_errors = Counter(
+            "runner_docker_errors_total", "Failed docker api calls", ("method",)
+        )
+        self.output_bytes = Histogram(
+            "runner_output_bytes",
+            "Size of run output",
+            ("language", "stream"),
+            SIZE_BUCKETS,
+        )
+        self.run_phase_seconds = Histogram(
+            "runner_run_phase_seconds",
+            "Wall time of compilation and execution measured inside container",
+            ("phase", "language"),
+        )
+        self.cpu_seconds = Histogram(
+            "runner_cpu_seconds",
+            "Cpu time of executed program",
+            ("mode", "language"),
+        )
+        self.peak_memory_bytes = Histogram(
+            "runner_peak_memory_bytes",
+            "Peak memory usage of container",
+            ("language",),
+            MEMORY_BUCKETS,
+        )
+        self.oom_kills = Counter(
+            "runner_oom_kills_total",
+            "Runs with processes killed by oom killer",
+            ("language",),
+        )
+        self.cpuset_busy_seconds = Counter(
+            "runner_cpuset_busy_seconds_total",
+            "Time cpu slot was taken by run",
+            ("cpus",),
+        )
+        self.image_pull_seconds = Histogram(
+            "runner_image_pull_seconds",
+            "Duration of language image pulls",
+            ("language",),
+            PULL_BUCKETS,
+        )
+        self.reaped_containers = Counter(
+            "runner_reaped_containers_total", "Orphaned containers removed by reaper"
+        )
+        self.running_containers = Gauge(
+            "runner_running_containers", "Containers running user code"
+        )
+        self.max_containers = Gauge(
+            "runner_max_containers", "Maximum number of containers running user code"
+        )
+
+    def render(self) -> str:
+        lines = []
+        for metric in vars(self).values():
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
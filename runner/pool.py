@@ -0,0 +1,400 @@
+import time
+import asyncio
+import logging
+
+from typing import TYPE_CHECKING, Any, Set, Dict, List, Iterable, Optional
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+# keeps container alive without doing anything until code is executed with exec
+IDLE_ENTRYPOINT = ["sh", "-c", "while :; do sleep 3600; done"]
+
+EVICT_INTERVAL = 30
+
+REUSE_MAX_RUNS = 100
+
+REUSE_MAX_AGE = 300
+
+# code in reused containers runs as nobody, otherwise it could change image files
+# used by next runs
+REUSE_USER = "65534:65534"
+
+# kilobytes allowed to be left in wiped directories
+REUSE_MAX_DISK = 1024
+
+# runs as root between runs in reused container: kills processes of previous run,
+# wipes directories writable by nobody and prints number of processes left,
+# kilobytes left in wiped directories and number of oom kills in container
+RESET_SCRIPT = """
+kill -9 -1 2> /dev/null
+dirs="/sandbox /tmp /var/tmp /dev/shm /run/lock"
+for dir in $dirs; do
+  find "$dir" -mindepth 1 -delete 2> /dev/null
+done
+chown 65534:65534 /sandbox
+chmod 755 /sandbox
+awk '/^State:/ { zombie = $2 == "Z" } /^Uid:/ && $2 == 65534 && !zombie { n++ }
+  END { printf "%d ", n }' /proc/[0-9]*/status 2> /dev/null
+du -sck $dirs 2> /dev/null | tail -n 1 | cut -f 1 | tr -d "\n"
+cat /sys/fs/cgroup/memory.events /sys/fs/cgroup/memory/memory.oom_control \
+  2> /dev/null | awk '$1 == "oom_kill" { n += $2 } END { printf " %d\n", n }'
+"""
+
+RESET_COMMAND = ["sh", "-c", RESET_SCRIPT]
+
+
+class WarmContainer:
+    def __init__(self, container_id: str, language: str):
+        self.id = container_id
+        self.language = language
+        self.created_at = time.monotonic()
+
+        # finished runs, only reused containers have more than one
+        self.runs = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id={self.id} language={self.language}>"
+
+
+class WarmPool:
+    def __init__(
+        self,
+        runner: "DockerRunner",
+        size: int,
+        idle_timeout: float,
+        languages: Iterable[str] = (),
+        reuse_languages: Iterable[str] = (),
+        reuse_max_runs: int = REUSE_MAX_RUNS,
+        reuse_max_age: float = REUSE_MAX_AGE,
+    ):
+        self._runner = runner
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._languages = set(languages)
+        self._reuse_languages = set(reuse_languages)
+        self._reuse_max_runs = reuse_max_runs
+        self._reuse_max_age = reuse_max_age
+
+        self._containers: Dict[str, List[WarmContainer]] = {}
+        # ids of containers that are not discarded yet, including running ones
+        self._tracked: Set[str] = set()
+        self._commands: Dict[str, List[str]] = {}
+        self._last_used: Dict[str, float] = {}
+
+        # language -> time image was replaced, older containers are not reused
+        self._forgotten_at: Dict[str, float] = {}
+
+        # containers of reused languages that are running code or being reset
+        self._returning: Dict[str, int] = {}
+
+        self._refill_tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._reset_tasks: Set["asyncio.Task[None]"] = set()
+        self._evict_task: Optional["asyncio.Task[None]"] = None
+
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+        self._reused = 0
+        self._recycled = 0
+
+    async def start(self) -> None:
+        for language in self._languages:
+            self._schedule_refill(language)
+
+        self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def close(self) -> None:
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+
+        for task in self._refill_tasks.values():
+            task.cancel()
+
+        for task in self._reset_tasks:
+            task.cancel()
+
+        for containers in self._containers.values():
+            for container in containers:
+                self.discard(container)
+
+        self._containers.clear()
+
+    def acquire(self, language: str) -> Optional[WarmContainer]:
+        self._last_used[language] = time.monotonic()
+
+        containers = self._containers.get(language)
+        container = containers.pop(0) if containers else None
+
+        if container is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+
+            if self.reuses(language):
+                self._returning[language] = self._returning.get(language, 0) + 1
+
+        self._schedule_refill(language)
+
+        return container
+
+    def discard(self, container: WarmContainer) -> None:
+        self._tracked.discard(container.id)
+        self._runner.schedule_removal(container.id, container.language)
+
+    def tracks(self, container_id: str) -> bool:
+        return container_id in self._tracked
+
+    def forget(self, language: str) -> None:
+        """Replaces containers of language after image update."""
+
+        self._forgotten_at[language] = time.monotonic()
+        self._commands.pop(language, None)
+
+        for container in self._containers.pop(language, ()):
+            self.discard(container)
+
+        # running refill may be creating containers from previous image
+        task = self._refill_tasks.pop(language, None)
+        if task is not None:
+            task.cancel()
+
+        if language in self._languages or language in self._last_used:
+            self._schedule_refill(language)
+
+    def reuses(self, language: str) -> bool:
+        return language in self._reuse_languages
+
+    def release(self, container: WarmContainer, clean: bool) -> None:
+        """
+        Returns container after run. Containers of reused languages are reset and put
+        back to pool unless run was not clean (killed or over output limit) or
+        container ran too many runs or is too old. Other containers are removed.
+        """
+
+        container.runs += 1
+
+        if not self.reuses(container.language):
+            self.discard(container)
+
+            return
+
+        if (
+            clean
+            and container.runs < self._reuse_max_runs
+            and time.monotonic() - container.created_at < self._reuse_max_age
+            and container.created_at > self._forgotten_at.get(container.language, 0)
+        ):
+            task = asyncio.create_task(self._reuse(container))
+
+            self._reset_tasks.add(task)
+            task.add_done_callback(self._reset_tasks.discard)
+        else:
+            self._recycle(container)
+
+    def _recycle(self, container: WarmContainer) -> None:
+        self._returning[container.language] -= 1
+        self._recycled += 1
+
+        self.discard(container)
+
+        # refill skipped container while it was expected to return
+        self._schedule_refill(container.language)
+
+    async def _reuse(self, container: WarmContainer) -> None:
+        try:
+            clean = await self.reset(container)
+        except asyncio.CancelledError:
+            self.discard(container)
+
+            raise
+
+        if not clean:
+            self._recycle(container)
+
+            return
+
+        self._returning[container.language] -= 1
+        self._reused += 1
+
+        self._containers.setdefault(container.language, []).append(container)
+
+    async def reset(self, container: WarmContainer) -> bool:
+        """Cleans container for next run, returns False if it is not reusable."""
+
+        try:
+            exec_result = await self._runner.docker_request(
+                "POST",
+                f"containers/{container.id}/exec",
+                body={
+                    "Cmd": RESET_COMMAND,
+                    "User": "0",
+                    "AttachStdout": True,
+                    "AttachStderr": True,
+                },
+            )
+            exec_id = exec_result["Id"]
+
+            async with self._runner.docker_hijack(
+                f"exec/{exec_id}/start", body={"Detach": False, "Tty": False}
+            ) as (reader, _):
+                stdout, _, _, _ = await self._runner.read_output(reader)
+
+            inspect_result = await self._runner.docker_request(
+                "GET", f"exec/{exec_id}/json"
+            )
+        except web.HTTPException:  # already logged by docker_request
+            return False
+
+        try:
+            processes, disk, oom_kills = map(int, stdout.decode().split())
+        except ValueError:
+            log.warning("unexpected reset output of %s: %r", container, stdout.decode())
+
+            return False
+
+        if inspect_result["ExitCode"] != 0 or processes or oom_kills:
+            log.debug(
+                "not reusing %s: %d processes left, %d oom kills",
+                container,
+                processes,
+                oom_kills,
+            )
+
+            return False
+
+        if disk > REUSE_MAX_DISK:
+            log.debug("not reusing %s: %d KiB left", container, disk)
+
+            return False
+
+        return True
+
+    async def command(self, language: str) -> List[str]:
+        """Returns entrypoint and command of language image."""
+
+        if language not in self._commands:
+            image = await self._runner.inspect_image(language)
+            config = image["Config"]
+
+            self._commands[language] = [
+                *(config.get("Entrypoint") or ()),
+                *(config.get("Cmd") or ()),
+            ]
+
+        return self._commands[language]
+
+    def _schedule_refill(self, language: str) -> None:
+        if language in self._refill_tasks:
+            return
+
+        task = asyncio.create_task(self._refill(language))
+        self._refill_tasks[language] = task
+
+        def done(_: "asyncio.Task[None]") -> None:
+            # cancelled task may already be replaced by forget
+            if self._refill_tasks.get(language) is task:
+                del self._refill_tasks[language]
+
+        task.add_done_callback(done)
+
+    async def _refill(self, language: str) -> None:
+        try:
+            await self.command(language)
+
+            while (
+                len(self._containers.get(language, ()))
+                + self._returning.get(language, 0)
+                < self._size
+            ):
+                created_at = time.monotonic()
+
+                config = self._runner.container_config(language, [], warm=True)
+                config["Entrypoint"] = IDLE_ENTRYPOINT
+
+                if self.reuses(language):
+                    # setuid binaries can not give user code root back
+                    config["HostConfig"]["SecurityOpt"] = ["no-new-privileges"]
+
+                create_result = await self._runner.docker_request(
+                    "POST", "containers/create", body=config
+                )
+                container = WarmContainer(create_result["Id"], language)
+                self._tracked.add(container.id)
+
+                try:
+                    await self._runner.docker_request(
+                        "POST", f"containers/{container.id}/start"
+                    )
+
+                    # gives sandbox to user of reused containers
+                    reset = not self.reuses(language) or await self.reset(container)
+                except (web.HTTPException, asyncio.CancelledError):
+                    self.discard(container)
+                    raise
+
+                if not reset:
+                    self.discard(container)
+
+                    log.warning("unable to prepare %s for reuse", container)
+
+                    return
+
+                # image was updated while container was being created
+                if created_at <= self._forgotten_at.get(language, 0):
+                    self.discard(container)
+
+                    continue
+
+                self._containers.setdefault(language, []).append(container)
+        except web.HTTPException:
+            log.warning("unable to refill warm pool for %s", language)
+
+    def _is_wanted(self, language: str, now: float) -> bool:
+        if language in self._languages:
+            return True
+
+        return now - self._last_used.get(language, 0) < self._idle_timeout
+
+    async def _evict_loop(self) -> None:
+        while True:
+            await asyncio.sleep(min(EVICT_INTERVAL, self._idle_timeout))
+
+            now = time.monotonic()
+
+            for language, containers in self._containers.items():
+                if not containers or self._is_wanted(language, now):
+                    continue
+
+                log.debug("evicting %d idle %s containers", len(containers), language)
+
+                for container in containers:
+                    self.discard(container)
+
+                self._evicted += len(containers)
+                containers.clear()
+
+    def ready(self) -> Dict[str, int]:
+        """Returns number of ready containers of each language."""
+
+        return {
+            language: len(containers)
+            for language, containers in self._containers.items()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            size=self._size,
+            hits=self._hits,
+            misses=self._misses,
+            evicted=self._evicted,
+            reuse_languages=sorted(self._reuse_languages),
+            reused=self._reused,
+            recycled=self._recycled,
+            returning=self._returning,
+            ready=self.ready(),
+        )
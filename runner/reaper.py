@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+
+from json import dumps
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .pool import WarmPool
+    from .runner import DockerRunner
+
+log = logging.getLogger(__name__)
+
+# stable identity of runner on docker host, instance is process of runner
+LABEL_RUNNER = "io.iomirea.run.runner"
+LABEL_INSTANCE = "io.iomirea.run.instance"
+LABEL_LANGUAGE = "io.iomirea.run.language"
+LABEL_CREATED = "io.iomirea.run.created"
+LABEL_WARM = "io.iomirea.run.warm"
+
+REAPER_INTERVAL = 300
+
+# containers of this runner older than this are removed, should be longer than
+# longest possible run
+REAPER_MAX_AGE = 300
+
+# added to max age for containers of other runner instances, their clocks and
+# configuration may differ
+REAPER_FOREIGN_MARGIN = 60
+
+
+class Reaper:
+    """
+    Removes runner containers left after crashes.
+
+    Containers are removed when they are older than max age, except for warm pool
+    ones that pool still tracks. Warm containers of previous instances of this runner
+    are removed too, runner restarted after crash recognizes them by runner id.
+
+    Docker host can be shared by several runners: containers of other runners are
+    given margin on top of max age and their warm containers are only removed if
+    foreign_warm is set.
+    """
+
+    def __init__(
+        self,
+        runner: "DockerRunner",
+        runner_id: str,
+        instance_id: str,
+        interval: float = REAPER_INTERVAL,
+        max_age: float = REAPER_MAX_AGE,
+        concurrency: int = 4,
+        foreign_warm: bool = False,
+        pool: Optional["WarmPool"] = None,
+    ):
+        self._runner = runner
+        self._runner_id = runner_id
+        self._instance_id = instance_id
+        self._interval = interval
+        self._max_age = max_age
+        self._concurrency = concurrency
+        self._foreign_warm = foreign_warm
+        self._pool = pool
+
+        self._runs = 0
+        self._reaped = 0
+        self._space_reclaimed = 0
+
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def reap(self) -> int:
+        """Returns number of removed containers."""
+
+        label_filter = {"label": [LABEL_RUNNER]}
+
+        # stopped containers are removed in one request
+        prune_result = await self._runner.docker_request(
+            "POST",
+            "containers/prune",
+            {"filters": dumps(dict(label_filter, until=[f"{int(self._max_age)}s"]))},
+        )
+        pruned = len(prune_result.get("ContainersDeleted") or ())
+
+        containers = await self._runner.docker_request(
+            "GET", "containers/json", {"all": 1, "filters": dumps(label_filter)}
+        )
+
+        now = time.time()
+        stale = [
+            container["Id"]
+            for container in containers
+            if self._is_stale(
+                container["Id"], container["Labels"] or {}, now - container["Created"]
+            )
+        ]
+
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def remove(container_id: str) -> bool:
+            async with semaphore:
+                try:
+                    await self._runner.remove_container(container_id)
+                except web.HTTPException:  # already logged by docker_request
+                    return False
+
+                return True
+
+        removed = sum(await asyncio.gather(*map(remove, stale)))
+
+        reaped = pruned + removed
+
+        self._runs += 1
+        self._reaped += reaped
+        self._space_reclaimed += prune_result.get("SpaceReclaimed") or 0
+
+        self._runner.metrics.reaped_containers.inc(amount=reaped)
+
+        if reaped:
+            log.info("reaped %d containers", reaped)
+
+        return reaped
+
+    def _is_stale(self, container_id: str, labels: Dict[str, str], age: float) -> bool:
+        if labels.get(LABEL_RUNNER) != self._runner_id:
+            # warm containers of live runner wait for runs for as long as it wants
+            if labels.get(LABEL_WARM):
+                return self._foreign_warm
+
+            return age > self._max_age + REAPER_FOREIGN_MARGIN
+
+        if (
+            labels.get(LABEL_WARM)
+            and labels.get(LABEL_INSTANCE) == self._instance_id
+            and self._pool is not None
+            and self._pool.tracks(container_id)
+        ):
+            return False
+
+        # previous instance may still be draining, pool may be creating container
+        return age > self._max_age
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.reap()
+            except web.HTTPException:  # already logged by docker_request
+                pass
+
+            await asyncio.sleep(self._interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            runs=self._runs,
+            reaped=self._reaped,
+            space_reclaimed=self._space_reclaimed,
+        )
@@ -0,0 +1,165 @@
+import json
+import time
+import hashlib
+import logging
+
+from typing import Any, Dict, Tuple, Optional
+from collections import OrderedDict
+
+import aioredis
+
+log = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "run-result:"
+
+
+class ResultCache:
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+
+        self._hits = 0
+        self._misses = 0
+
+    async def setup(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = await self._get(key)
+
+        if result is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+
+        return result
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            backend=self.__class__.__name__,
+            ttl=self._ttl,
+            hits=self._hits,
+            misses=self._misses,
+        )
+
+
+class MemoryResultCache(ResultCache):
+    """
+    Keeps results in memory, bounded by number of results and their serialized size.
+
+    Results larger than max size are not cached.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_size: int):
+        super().__init__(ttl)
+
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._size = 0
+
+        # key -> (expiration time, size, result), ordered from least to most recently
+        # used
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, _, result = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+
+            return None
+
+        self._entries.move_to_end(key)
+
+        return dict(result)
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        # output dominates size of result
+        size = len(json.dumps(result))
+        if size > self._max_size:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self._ttl, size, dict(result))
+        self._size += size
+
+        while len(self._entries) > self._max_entries or self._size > self._max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            super().stats(),
+            entries=len(self._entries),
+            max_entries=self._max_entries,
+            size=self._size,
+            max_size=self._max_size,
+        )
+
+
+class RedisResultCache(ResultCache):
+    """Shares results between nodes. Redis is responsible for eviction."""
+
+    def __init__(self, ttl: float, address: Tuple[str, int], **kwargs: Any):
+        super().__init__(ttl)
+
+        self._address = address
+        self._kwargs = kwargs
+
+        self._redis: aioredis.Redis
+
+    async def setup(self) -> None:
+        log.debug("creating result cache redis connection")
+
+        self._redis = await aioredis.create_redis_pool(self._address, **self._kwargs)
+
+    async def close(self) -> None:
+        log.debug("closing result cache redis connection")
+
+        self._redis.close()
+        await self._redis.wait_closed()
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = await self._redis.get(f"{REDIS_KEY_PREFIX}{key}")
+        except (aioredis.RedisError, OSError) as e:
+            log.error(f"unable to get cached result: {e}")
+
+            return None
+
+        if value is None:
+            return None
+
+        return json.loads(value)
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        try:
+            await self._redis.set(
+                f"{REDIS_KEY_PREFIX}{key}",
+                json.dumps(result),
+                pexpire=int(self._ttl * 1000),
+            )
+        except (aioredis.RedisError, OSError) as e:
+            log.error(f"unable to cache result: {e}")
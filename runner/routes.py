@@ -1,14 +1,25 @@
 import os
+import json
+import codecs
 import logging
 
 from json import JSONDecodeError
+from typing import Any, Dict, List
 
 from aiohttp import web
 
+from . import jobs, capacity
+
 routes = web.RouteTableDef()
 
 log = logging.getLogger(__name__)
 
+STREAM_NAMES = {1: "stdout", 2: "stderr"}
+
+
+class _ClientGone(Exception):
+    """Raised from output callback to abort run of disconnected client."""
+
 
 @routes.get("/")
 async def index(req: web.Request) -> web.Response:
@@ -17,13 +28,24 @@ async def index(req: web.Request) -> web.Response:
 
 @routes.route("OPTIONS", "/health_check")
 async def healthcheck(req: web.Request) -> web.Response:
-    return web.Response(status=404 if req.config_dict["runner"].busy else 200)
+    runner = req.config_dict["runner"]
+    load = runner.load()
+
+    return web.Response(
+        status=404 if runner.busy else 200,
+        headers={
+            "X-Free-Slots": str(load["free_slots"]),
+            "X-Queue-Size": str(load["queue_size"]),
+        },
+    )
 
 
-@routes.post("/run/{language_name}")
-async def run_code(req: web.Request) -> web.Response:
-    language = req.match_info["language_name"]
+@routes.get("/stats")
+async def stats(req: web.Request) -> web.Response:
+    return web.json_response(req.config_dict["runner"].stats())
 
+
+async def read_run_request(req: web.Request, batch: bool = False) -> Dict[str, Any]:
     try:
         data = await req.json()
     except JSONDecodeError:
@@ -39,8 +61,206 @@ async def run_code(req: web.Request) -> web.Response:
     ):
         compile_commands.append(f"{compiler} {compile_args}")
 
+    priority = data.get("priority", 0)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise web.HTTPBadRequest(reason="priority should be an integer")
+
+    kwargs = dict(
+        language=req.match_info["language_name"],
+        code=code,
+        compile_commands=compile_commands,
+        merge_output=data["merge_output"],
+        priority=priority,
+    )
+
+    # lower configured output limits, see OutputLimits
+    for key in ("output_head", "output_tail", "output_cap"):
+        value = data.get(key)
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise web.HTTPBadRequest(
+                    reason=f"{key} should be a non negative integer"
+                )
+
+            kwargs[key] = value
+
+    if batch:
+        kwargs["cases"] = read_batch_cases(data.get("cases"))
+    else:
+        kwargs["input"] = data.pop("input")
+
+    return kwargs
+
+
+def read_batch_cases(cases: Any) -> List[Dict[str, Any]]:
+    if not isinstance(cases, list):
+        raise web.HTTPBadRequest(reason="Cases should be a list")
+
+    for case in cases:
+        if not isinstance(case, dict):
+            raise web.HTTPBadRequest(reason="Case should be an object")
+
+        if not isinstance(case.get("input", ""), (str, type(None))):
+            raise web.HTTPBadRequest(reason="Case input should be a string")
+
+        for key in ("timeout", "output_limit"):
+            value = case.get(key)
+            if value is not None and (
+                isinstance(value, bool)
+                or not isinstance(value, (int, float))
+                or value <= 0
+            ):
+                raise web.HTTPBadRequest(
+                    reason=f"Case {key} should be a positive number"
+                )
+
+    return cases
+
+
+@routes.get("/nodes")
+async def nodes(req: web.Request) -> web.Response:
+    return web.json_response(await get_capacity(req).nodes())
+
+
+@routes.get("/nodes/{language_name}")
+async def pick_node(req: web.Request) -> web.Response:
+    """Returns node best suited for running language."""
+
+    node = capacity.pick_node(
+        await get_capacity(req).nodes(), req.match_info["language_name"]
+    )
+    if node is None:
+        raise web.HTTPServiceUnavailable(reason="No nodes with free containers")
+
+    return web.json_response(node)
+
+
+def get_capacity(req: web.Request) -> capacity.CapacityAdvertiser:
+    advertiser = req.config_dict.get("capacity")
+    if advertiser is None:
+        raise web.HTTPNotFound(reason="Capacity advertising is disabled")
+
+    return advertiser
+
+
+@routes.get("/metrics")
+async def metrics(req: web.Request) -> web.Response:
+    return web.Response(
+        text=req.config_dict["runner"].render_metrics(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+@routes.post("/run/{language_name}")
+async def run_code(req: web.Request) -> web.Response:
+    return web.json_response(
+        await req.config_dict["runner"].run_code(**await read_run_request(req))
+    )
+
+
+@routes.post("/run/{language_name}/batch")
+async def run_batch(req: web.Request) -> web.Response:
     return web.json_response(
-        await req.config_dict["runner"].run_code(
-            language, code, data.pop("input"), compile_commands, data["merge_output"]
+        await req.config_dict["runner"].run_batch(
+            **await read_run_request(req, batch=True)
         )
     )
+
+
+@routes.post("/run/{language_name}/job")
+async def submit_job(req: web.Request) -> web.Response:
+    """Queues run, result is returned by GET /jobs/{job_id}."""
+
+    job_id = await get_jobs(req).submit(await read_run_request(req))
+
+    return web.json_response(
+        dict(id=job_id, status=jobs.STATUS_QUEUED),
+        status=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@routes.get("/jobs/{job_id}")
+async def get_job(req: web.Request) -> web.Response:
+    """Returns job. With wait query parameter waits for job to finish."""
+
+    try:
+        wait = min(float(req.query.get("wait", 0)), jobs.MAX_WAIT)
+    except ValueError:
+        raise web.HTTPBadRequest(reason="Wait should be a number")
+
+    job = await get_jobs(req).get(req.match_info["job_id"], wait)
+    if job is None:
+        raise web.HTTPNotFound(reason="Job not found")
+
+    return web.json_response(job)
+
+
+def get_jobs(req: web.Request) -> jobs.JobQueue:
+    queue = req.config_dict.get("jobs")
+    if queue is None:
+        raise web.HTTPNotFound(reason="Jobs are disabled")
+
+    return queue
+
+
+@routes.post("/run/{language_name}/stream")
+async def run_code_stream(req: web.Request) -> web.StreamResponse:
+    """Writes output as newline delimited json frames followed by run result."""
+
+    kwargs = await read_run_request(req)
+
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+
+    decoders = {
+        stream_type: codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for stream_type in STREAM_NAMES
+    }
+
+    async def write_frame(frame: Dict[str, Any]) -> None:
+        if not resp.prepared:
+            await resp.prepare(req)
+
+        # waits for client to read data if write buffer is full
+        try:
+            await resp.write(json.dumps(frame).encode() + b"\n")
+        except ConnectionResetError as e:
+            # not OSError, runner should not blame docker for it
+            raise _ClientGone from e
+
+    async def on_output(stream_type: int, chunk: bytes) -> None:
+        if stream_type not in STREAM_NAMES:
+            return
+
+        data = decoders[stream_type].decode(chunk)
+        if data:
+            await write_frame(dict(stream=STREAM_NAMES[stream_type], data=data))
+
+    try:
+        try:
+            result = await req.config_dict["runner"].run_code(
+                **kwargs, on_output=on_output
+            )
+        except web.HTTPException as e:
+            if not resp.prepared:
+                raise
+
+            await write_frame(dict(error=e.reason))
+        else:
+            for stream_type, decoder in decoders.items():
+                data = decoder.decode(b"", final=True)
+                if data:
+                    await write_frame(dict(stream=STREAM_NAMES[stream_type], data=data))
+
+            result.pop("stdout")
+            result.pop("stderr")
+
+            await write_frame(result)
+    except _ClientGone:
+        log.debug("client disconnected from output stream")
+
+        return resp
+
+    await resp.write_eof()
+
+    return resp
@@ -1,48 +1,180 @@
 import os
+import math
+import time
+import random
 import signal
 import asyncio
 import logging
 
 from copy import copy
+from typing import Any, Dict, List, Tuple, Optional
+from functools import partial
+
+import aioredis
 
 from jarpc import Server, Request
 from aiohttp import web
 
-from .utils import run_shell_command
+from .capacity import REDIS_NODES_KEY, node_id
 
 log = logging.getLogger(__name__)
 
 COMMAND_UPDATE_RUNNERS = 0
 COMMAND_UPDATE_LANGUAGE = 1
+COMMAND_UPDATE_LANGUAGES = 2
+
+# seconds to wait for running containers before exiting
+DRAIN_TIMEOUT = 40
+
+# node id -> expiration timestamp of nodes being restarted
+REDIS_RESTARTING_KEY = "run-restarting"
+
+# seconds restarted node has to come back before its restart slot expires
+RESTART_TIMEOUT = 120
+
+# seconds between attempts to take restart slot
+RESTART_POLL_INTERVAL = 5
+
+# removes expired restart slots, adds node if less than allowed nodes are restarting
+TAKE_RESTART_SLOT_SCRIPT = """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+def redis_address(config: Dict[str, Any]) -> Tuple[Tuple[str, int], Dict[str, Any]]:
+    redis_config = copy(config["redis-rpc"])
+
+    host = redis_config.pop("host")
+    port = redis_config.pop("port")
+
+    return (host, port), redis_config
+
+
+async def wait_restart_turn(
+    app: web.Application, min_capacity: float, drain_timeout: float
+) -> None:
+    """
+    Waits until node can restart without fleet capacity dropping below min_capacity.
+
+    Number of nodes is taken from advertised capacity, at least one node restarts at
+    a time.
+    """
+
+    config = app["config"]
+    address, redis_config = redis_address(config)
+
+    redis = await aioredis.create_redis(address, **redis_config)
+    try:
+        while True:
+            now = time.time()
+
+            nodes = await redis.zcount(REDIS_NODES_KEY, min=now)
+            allowed = max(1, math.floor(nodes * (1 - min_capacity)))
+
+            if await redis.eval(
+                TAKE_RESTART_SLOT_SCRIPT,
+                keys=[REDIS_RESTARTING_KEY],
+                args=[
+                    now,
+                    allowed,
+                    now + drain_timeout + RESTART_TIMEOUT,
+                    node_id(config),
+                ],
+            ):
+                return
+
+            # spreads attempts of waiting nodes
+            await asyncio.sleep(RESTART_POLL_INTERVAL * random.uniform(0.5, 1.5))
+    finally:
+        redis.close()
+        await redis.wait_closed()
 
 
-async def update_self(req: Request) -> None:
+async def update_self(
+    app: web.Application,
+    req: Request,
+    min_capacity: Optional[float] = None,
+    drain_timeout: Optional[float] = None,
+) -> None:
+    """
+    Drains runner and exits. With min_capacity restarts are staggered so that at
+    least this fraction of nodes is running.
+    """
+
+    if drain_timeout is None:
+        drain_timeout = app["config"]["app"].get("drain-timeout", DRAIN_TIMEOUT)
+
+    if min_capacity is not None:
+        log.debug("waiting for restart turn")
+
+        await wait_restart_turn(app, min_capacity, drain_timeout)
+
+    await app["runner"].drain(drain_timeout)
+
     log.debug("killing process")
 
     os.kill(os.getpid(), signal.SIGTERM)
 
 
-async def update_language(req: Request, language: str) -> None:
+async def update_language(
+    app: web.Application, req: Request, language: str
+) -> Dict[str, Any]:
     log.debug("updating language %s", language)
 
-    await run_shell_command(f"docker pull iomirea/run-lang-{language}")
+    return await app["runner"].pull_image(language)
 
 
-async def on_startup(app: web.Application) -> None:
-    config = copy(app["config"]["redis-rpc"])
+async def update_languages(
+    app: web.Application, req: Request, languages: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Pulls images of languages in parallel, all present images by default."""
+
+    log.debug("updating languages %s", "all" if languages is None else languages)
+
+    return await app["runner"].pull_images(languages)
+
 
-    host = config.pop("host")
-    port = config.pop("port")
+async def release_restart_slot(app: web.Application) -> None:
+    """Lets next node restart, slot is taken by previous process of this node."""
+
+    address, redis_config = redis_address(app["config"])
+
+    try:
+        redis = await aioredis.create_redis(address, **redis_config)
+    except (aioredis.RedisError, OSError) as e:
+        log.error(f"unable to release restart slot: {e}")
+
+        return
+
+    try:
+        await redis.zrem(REDIS_RESTARTING_KEY, node_id(app["config"]))
+    except (aioredis.RedisError, OSError) as e:
+        log.error(f"unable to release restart slot: {e}")
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+async def on_startup(app: web.Application) -> None:
+    address, config = redis_address(app["config"])
 
     log.debug("creating rpc connection")
 
     server = Server("run-api")
-    server.add_command(COMMAND_UPDATE_RUNNERS, update_self)
-    server.add_command(COMMAND_UPDATE_LANGUAGE, update_language)
+    server.add_command(COMMAND_UPDATE_RUNNERS, partial(update_self, app))
+    server.add_command(COMMAND_UPDATE_LANGUAGE, partial(update_language, app))
+    server.add_command(COMMAND_UPDATE_LANGUAGES, partial(update_languages, app))
 
     app["rpc"] = server
 
-    asyncio.create_task(app["rpc"].start((host, port), **config))
+    asyncio.create_task(app["rpc"].start(address, **config))
+
+    await release_restart_slot(app)
 
 
 async def on_cleanup(app: web.Application) -> None:
@@ -51,5 +183,7 @@ async def on_cleanup(app: web.Application) -> None:
 
 
 def setup(app: web.Application) -> None:
+    """Should be called after runner setup is added to startup signal."""
+
     app.on_startup.append(on_startup)
     app.on_cleanup.append(on_cleanup)
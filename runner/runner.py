@@ -1,137 +1,677 @@
+import io
+import os
+import math
+import time
+import uuid
+import socket
 import asyncio
 import logging
+import tarfile
 
-from typing import Any, Dict, List, Union, Mapping, Optional
-from datetime import datetime
+from copy import copy
+from json import dumps, loads
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+    Union,
+    Mapping,
+    Callable,
+    NoReturn,
+    Optional,
+    Sequence,
+    Awaitable,
+    AsyncIterator,
+)
+from contextlib import AsyncExitStack, asynccontextmanager
 
 import aiohttp
 
+from yarl import URL
 from aiohttp import web
 from sentry_sdk import push_scope, configure_scope
 
+from .pool import REUSE_USER, REUSE_MAX_AGE, REUSE_MAX_RUNS, WarmPool, WarmContainer
+from .hosts import PROBE_TIMEOUT, PROBE_FAILURES, PROBE_INTERVAL, MultiHostRunner
+from .cpuset import CpuSlot, CpuSlots, parse_cpu_list
+from .images import PULL_CONCURRENCY, ImageManager
+from .reaper import (
+    LABEL_WARM,
+    LABEL_RUNNER,
+    LABEL_CREATED,
+    LABEL_INSTANCE,
+    LABEL_LANGUAGE,
+    REAPER_MAX_AGE,
+    REAPER_INTERVAL,
+    Reaper,
+)
+from .sizing import ConcurrencyController, optimal_container_count
+from .stream import STDERR, STDOUT, OutputLimits, HeadTailBuffer, StreamDemultiplexer
+from .metrics import Metrics
+from .capacity import node_id
+from .coalesce import Coalescer
+from .admission import AdmissionQueue, LanguageLimits
+from .constants import DATA_DIR
+from .accounting import UsageStats, parse_usage
+from .result_cache import ResultCache, RedisResultCache, MemoryResultCache
+from .compile_cache import CompileCache
+
 log = logging.getLogger(__name__)
 
-_ResultType = Dict[str, Union[str, int, float]]
+# values of resource usage fields are None when not available
+_ResultType = Dict[str, Any]
+
+# receives stream type (1 for stdout, 2 for stderr) and output chunk
+_OutputCallback = Callable[[int, bytes], Awaitable[None]]
 
 DOCKER_API_VERSION = "1.40"
 
-CPU_QUOTA = 100000
+CPU_PERIOD = 100000
 
+# per stream, only used as default limit of batch cases
 OUTPUT_LIMIT = 1024 * 1024
 
+# bytes of each stream kept from start and end of output by default
+OUTPUT_HEAD = OUTPUT_LIMIT // 2
+
+OUTPUT_TAIL = OUTPUT_LIMIT // 2
+
+# bytes of output read before program is killed
+OUTPUT_CAP = 16 * 1024 * 1024
+
+# bytes read from attached container at once
+READ_SIZE = 64 * 1024
+
 EXEC_TIMEOUT = 30
 
+WARM_POOL_IDLE_TIMEOUT = 600
+
+# compiled binary, collected after compile only run for compile cache
+EXEC_INPUT_PATH = "/sandbox/exec_input"
+
+# entrypoint writes phase timestamps and cgroup accounting here if set in
+# RUN_STATS_PATH
+RUN_STATS_PATH = "/tmp/run_stats"
+
+RESULT_CACHE_TTL = 60
+
+RESULT_CACHE_SIZE = 1000
+
+RESULT_CACHE_MEMORY = "64m"
+
+QUEUE_TIMEOUT = 10
+
+MAX_BATCH_CASES = 100
+
+# sum of case timeouts
+BATCH_TIMEOUT = 120
+
+# sum of case output limits
+BATCH_OUTPUT_LIMIT = 16 * 1024 * 1024
+
+# entrypoint writes results of batch cases here
+BATCH_OUTPUT_PATH = "/sandbox/batch_output"
+
+ADAPTIVE_API_LATENCY = 0.5
+
+ADAPTIVE_START_TIME = 2
+
+# number of containers removed at once in background
+REMOVAL_CONCURRENCY = 4
+
+# seconds close waits for scheduled removals, reaper removes what is left
+REMOVAL_TIMEOUT = 10
+
+# seconds between checks for finished runs while draining
+DRAIN_INTERVAL = 0.1
+
+# seconds between inspections of exec that closed output but is still running
+EXEC_POLL_INTERVAL = 0.05
+
 
 async def setup(app: web.Application) -> None:
     config = app["config"]
 
+    compile_cache = None
+    compile_cache_size = config["app"].get("compile-cache-size")
+    if compile_cache_size:
+        compile_cache = CompileCache(
+            config["app"].get("compile-cache-dir")
+            or os.sep.join((DATA_DIR, "compile_cache")),
+            dumb_megabytes_to_bytes(compile_cache_size),
+        )
+        compile_cache.load()
+
+    result_cache: Optional[ResultCache] = None
+    result_cache_backend = config["app"].get("result-cache")
+    result_cache_ttl = config["app"].get("result-cache-ttl", RESULT_CACHE_TTL)
+    if result_cache_backend == "memory":
+        result_cache = MemoryResultCache(
+            result_cache_ttl,
+            config["app"].get("result-cache-size", RESULT_CACHE_SIZE),
+            dumb_megabytes_to_bytes(
+                config["app"].get("result-cache-memory", RESULT_CACHE_MEMORY)
+            ),
+        )
+    elif result_cache_backend == "redis":
+        redis_config = copy(config["redis-rpc"])
+
+        host = redis_config.pop("host")
+        port = redis_config.pop("port")
+
+        result_cache = RedisResultCache(result_cache_ttl, (host, port), **redis_config)
+    elif result_cache_backend is not None:
+        raise ValueError(f"Unknown result cache backend: {result_cache_backend}")
+
+    # shared by runners of all docker endpoints
+    if result_cache is not None:
+        await result_cache.setup()
+
+    app["result_cache"] = result_cache
+
+    coalesce_window = config["app"].get("coalesce-window", 0)
+    coalescer = Coalescer(coalesce_window) if coalesce_window > 0 else None
+
+    metrics = Metrics()
+
     # TODO: docker username, password
-    runner = DockerRunner(
-        config["docker"]["socket"],
-        config["app"]["max-container-ram"],
-        config["app"]["max-container-cpu"],
-        config["app"]["max-containers"],
+    kwargs = dict(
+        warm_pool_size=config["app"].get("warm-pool-size", 0),
+        warm_pool_languages=config["app"].get("warm-pool-languages") or (),
+        warm_pool_idle_timeout=config["app"].get(
+            "warm-pool-idle-timeout", WARM_POOL_IDLE_TIMEOUT
+        ),
+        warm_pool_reuse_languages=config["app"].get("warm-pool-reuse-languages") or (),
+        warm_pool_reuse_max_runs=config["app"].get(
+            "warm-pool-reuse-max-runs", REUSE_MAX_RUNS
+        ),
+        warm_pool_reuse_max_age=config["app"].get(
+            "warm-pool-reuse-max-age", REUSE_MAX_AGE
+        ),
+        compile_cache=compile_cache,
+        result_cache=result_cache,
+        queue_size=config["app"].get("queue-size", 0),
+        queue_timeout=config["app"].get("queue-timeout", QUEUE_TIMEOUT),
+        language_limits={
+            language: LanguageLimits(limits.get("cost", 1), limits.get("max-running"))
+            for language, limits in (config["app"].get("language-limits") or {}).items()
+        },
+        adaptive_containers=config["app"].get("adaptive-containers", False),
+        adaptive_api_latency=config["app"].get(
+            "adaptive-api-latency", ADAPTIVE_API_LATENCY
+        ),
+        adaptive_start_time=config["app"].get(
+            "adaptive-start-time", ADAPTIVE_START_TIME
+        ),
+        reaper_interval=config["app"].get("reaper-interval", REAPER_INTERVAL),
+        reaper_max_age=config["app"].get("reaper-max-age", REAPER_MAX_AGE),
+        reaper_foreign_warm=config["app"].get("reaper-foreign-warm", False),
+        output_limits=OutputLimits(
+            config["app"].get("output-head", OUTPUT_HEAD),
+            config["app"].get("output-tail", OUTPUT_TAIL),
+            config["app"].get("output-cap", OUTPUT_CAP),
+        ),
+        coalescer=coalescer,
+        metrics=metrics,
+        cpuset_cpus=config["app"].get("cpuset-cpus"),
+        cpuset_numa=config["app"].get("cpuset-numa", False),
+        image_pull_concurrency=config["app"].get(
+            "image-pull-concurrency", PULL_CONCURRENCY
+        ),
+        image_prewarm=config["app"].get("image-prewarm", False),
+        node_id=node_id(config),
     )
+
+    endpoints = config["docker"].get("endpoints")
+
+    runner: Union[DockerRunner, MultiHostRunner]
+    if endpoints:
+        runner = MultiHostRunner(
+            [
+                DockerRunner(
+                    endpoint["url"],
+                    config["app"]["max-container-ram"],
+                    config["app"]["max-container-cpu"],
+                    endpoint.get("max-containers", config["app"]["max-containers"]),
+                    **dict(
+                        kwargs,
+                        cpuset_cpus=endpoint.get("cpuset-cpus", kwargs["cpuset_cpus"]),
+                    ),
+                )
+                for endpoint in endpoints
+            ],
+            metrics,
+            config["docker"].get("probe-interval", PROBE_INTERVAL),
+            config["docker"].get("probe-timeout", PROBE_TIMEOUT),
+            config["docker"].get("probe-failures", PROBE_FAILURES),
+        )
+    else:
+        runner = DockerRunner(
+            config["docker"]["socket"],
+            config["app"]["max-container-ram"],
+            config["app"]["max-container-cpu"],
+            config["app"]["max-containers"],
+            **kwargs,
+        )
+
     await runner.setup()
 
     app["runner"] = runner
 
 
+async def cleanup(app: web.Application) -> None:
+    await app["runner"].close()
+
+    if app["result_cache"] is not None:
+        await app["result_cache"].close()
+
+
 def dumb_megabytes_to_bytes(mb: str) -> int:
     if mb.lower().endswith("m"):
         mb = mb[:-1]
-    return int(mb) // (1024 * 1024)
+    return int(mb) * 1024 * 1024
 
 
 class DockerRunner:
+    """
+    Runs code in containers of one docker engine.
+
+    Endpoint is unix socket path or tcp://host:port url. Result cache lifecycle is
+    managed by caller, it can be shared with other runners like coalescer and metrics.
+    """
+
     def __init__(
         self,
-        socket_path: str,
+        endpoint: str,
         max_ram: str,
         max_cpu: float,
         max_containers: Optional[int] = None,
+        warm_pool_size: int = 0,
+        warm_pool_languages: Sequence[str] = (),
+        warm_pool_idle_timeout: float = WARM_POOL_IDLE_TIMEOUT,
+        warm_pool_reuse_languages: Sequence[str] = (),
+        warm_pool_reuse_max_runs: int = REUSE_MAX_RUNS,
+        warm_pool_reuse_max_age: float = REUSE_MAX_AGE,
+        compile_cache: Optional[CompileCache] = None,
+        result_cache: Optional[ResultCache] = None,
+        queue_size: int = 0,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        language_limits: Mapping[str, LanguageLimits] = {},
+        adaptive_containers: bool = False,
+        adaptive_api_latency: float = ADAPTIVE_API_LATENCY,
+        adaptive_start_time: float = ADAPTIVE_START_TIME,
+        reaper_interval: float = REAPER_INTERVAL,
+        reaper_max_age: float = REAPER_MAX_AGE,
+        reaper_foreign_warm: bool = False,
+        output_limits: OutputLimits = OutputLimits(
+            OUTPUT_HEAD, OUTPUT_TAIL, OUTPUT_CAP
+        ),
+        coalescer: Optional[Coalescer] = None,
+        metrics: Optional[Metrics] = None,
+        cpuset_cpus: Optional[str] = None,
+        cpuset_numa: bool = False,
+        image_pull_concurrency: int = PULL_CONCURRENCY,
+        image_prewarm: bool = False,
+        node_id: Optional[str] = None,
     ):
-        self._socket = socket_path
-        self._url_base = f"unix://{DOCKER_API_VERSION}"
+        self.endpoint = endpoint
+
+        url = URL(endpoint)
+        if url.scheme in ("tcp", "http"):
+            self._socket = None
+            self._address: Tuple[str, int] = (url.host or "", url.port or 2375)
+            self._url_base = f"http://{self._address[0]}:{self._address[1]}"
+        else:
+            self._socket = url.path if url.scheme == "unix" else endpoint
+            self._url_base = f"unix://{DOCKER_API_VERSION}"
+
         self._max_ram = dumb_megabytes_to_bytes(max_ram)
         self._max_cpu = max_cpu
 
-        self._max_containers = (
-            self.calculate_optimal_container_count()
-            if max_containers is None
-            else max_containers
+        # containers are labeled with both to find containers of crashed runners
+        self._runner_id = f"{node_id or socket.gethostname()}:{endpoint}"
+        self._instance_id = uuid.uuid4().hex
+
+        if max_containers is None:
+            # resources of this host say nothing about remote one
+            if self._socket is None:
+                raise ValueError(f"max-containers is required for {endpoint}")
+
+            max_containers = self.calculate_optimal_container_count()
+
+        self._max_containers = max_containers
+
+        self._cpuset = (
+            CpuSlots(
+                parse_cpu_list(cpuset_cpus), max(1, math.ceil(max_cpu)), cpuset_numa
+            )
+            if cpuset_cpus
+            else None
+        )
+        if self._cpuset is not None and len(self._cpuset) < self._max_containers:
+            log.info(
+                "limiting containers to %d cpu slots instead of %d",
+                len(self._cpuset),
+                self._max_containers,
+            )
+
+            self._max_containers = len(self._cpuset)
+
+        self._admission = AdmissionQueue(
+            self._max_containers, queue_size, queue_timeout, language_limits
+        )
+
+        self._concurrency = (
+            ConcurrencyController(
+                self._admission,
+                1,
+                self._max_containers,
+                adaptive_api_latency,
+                adaptive_start_time,
+            )
+            if adaptive_containers
+            else None
+        )
+
+        self._pool = (
+            WarmPool(
+                self,
+                warm_pool_size,
+                warm_pool_idle_timeout,
+                warm_pool_languages,
+                warm_pool_reuse_languages,
+                warm_pool_reuse_max_runs,
+                warm_pool_reuse_max_age,
+            )
+            if warm_pool_size > 0
+            else None
+        )
+        self._compile_cache = compile_cache
+        self._result_cache = result_cache
+
+        self._reaper = (
+            Reaper(
+                self,
+                self._runner_id,
+                self._instance_id,
+                reaper_interval,
+                reaper_max_age,
+                REMOVAL_CONCURRENCY,
+                reaper_foreign_warm,
+                self._pool,
+            )
+            if reaper_interval > 0
+            else None
         )
 
-        self._running_containers = 0
+        self._output_limits = output_limits
+
+        self._coalescer = coalescer
+
+        self._images: Dict[str, Dict[str, Any]] = {}
+
+        self.images = ImageManager(self, image_pull_concurrency, image_prewarm)
+
+        self.metrics = Metrics() if metrics is None else metrics
+        self._usage = UsageStats()
+
+        self._removal_queue: "asyncio.Queue[Tuple[str, str]]"
+        self._removal_workers: List["asyncio.Task[None]"] = []
 
         self._session: aiohttp.ClientSession
 
     async def setup(self) -> None:
         self._session = aiohttp.ClientSession(
-            connector=aiohttp.UnixConnector(path=self._socket)
+            connector=aiohttp.TCPConnector()
+            if self._socket is None
+            else aiohttp.UnixConnector(path=self._socket)
         )
 
-    async def docker_request(
+        self._removal_queue = asyncio.Queue()
+        self._removal_workers = [
+            asyncio.create_task(self._removal_worker())
+            for _ in range(REMOVAL_CONCURRENCY)
+        ]
+
+        try:
+            await self.images.refresh()
+        except (web.HTTPException, aiohttp.ClientError) as e:
+            log.warning(f"unable to index images: {e!r}")
+
+        if self._pool is not None:
+            await self._pool.start()
+
+        if self._concurrency is not None:
+            self._concurrency.start()
+
+        if self._reaper is not None:
+            self._reaper.start()
+
+    async def close(self) -> None:
+        if self._concurrency is not None:
+            self._concurrency.close()
+
+        if self._reaper is not None:
+            self._reaper.close()
+
+        if self._pool is not None:
+            await self._pool.close()
+
+        try:
+            await asyncio.wait_for(self._removal_queue.join(), REMOVAL_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("container removals did not finish, left for reaper")
+
+        for worker in self._removal_workers:
+            worker.cancel()
+
+        await self._session.close()
+
+    def _docker_error(
+        self, method: str, url: Any, status: int, body: Any, json: Dict[str, Any]
+    ) -> NoReturn:
+        with push_scope() as scope:
+            scope.set_extra("request", body)
+            scope.set_extra("response", json)
+
+        log.error(f"{url}: {status} ({json.get('message')})")
+
+        self.metrics.docker_errors.inc(method)
+
+        raise web.HTTPInternalServerError(reason="Docker API error")
+
+    @asynccontextmanager
+    async def docker_stream(
         self,
         method: str = "GET",
         path: str = "",
         params: Mapping[str, Any] = {},
         body: Any = None,
-        stream: bool = False,
-    ) -> Any:
+        data: Optional[bytes] = None,
+        ignore_missing: bool = False,
+        observe_latency: bool = True,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> AsyncIterator[Optional[aiohttp.ClientResponse]]:
+        """Yields response after receiving headers, body is not read."""
+
         url = f"{self._url_base}/{path}"
         log.debug("%6s: %s", method, url)
 
-        async with self._session.request(method, url, params=params, json=body) as resp:
+        headers = None if data is None else {"Content-Type": "application/x-tar"}
+
+        started_at = time.monotonic()
+
+        async with self._session.request(
+            method,
+            url,
+            params=params,
+            json=body,
+            data=data,
+            headers=headers,
+            timeout=self._session.timeout if timeout is None else timeout,
+        ) as resp:
+            if self._concurrency is not None and observe_latency:
+                self._concurrency.observe_api_latency(time.monotonic() - started_at)
+
+            if resp.status == 404 and ignore_missing:
+                yield None
+
+                return
+
             if resp.status // 100 not in (2, 3):
-                json = await resp.json()
-                with push_scope() as scope:
-                    scope.set_extra("request", body)
-                    scope.set_extra("response", json)
+                self._docker_error(method, url, resp.status, body, await resp.json())
+
+            yield resp
+
+    @asynccontextmanager
+    async def docker_hijack(
+        self, path: str, params: Mapping[str, Any] = {}, body: Any = None
+    ) -> AsyncIterator[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """
+        Yields connection taken over by docker after POST request.
 
-                log.error(f"{url}: {resp.status} ({json['message']})")
+        Used for attach and exec start: aiohttp can not write stdin to connection
+        after response is received.
+        """
 
-                raise web.HTTPInternalServerError(reason="Docker API error")
+        url = URL(f"{self._url_base}/{path}").with_query(params)
+        log.debug("%6s: %s (hijack)", "POST", url)
 
-            if stream:
-                stdout = b""
-                stderr = b""
+        payload = b"" if body is None else dumps(body).encode()
 
-                header_size = 8
+        if self._socket is None:
+            reader, writer = await asyncio.open_connection(*self._address)
+        else:
+            reader, writer = await asyncio.open_unix_connection(self._socket)
+        try:
+            writer.write(
+                (
+                    f"POST {url.raw_path_qs} HTTP/1.1\r\n"
+                    f"Host: {url.raw_host}\r\n"
+                    "Connection: Upgrade\r\n"
+                    "Upgrade: tcp\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "\r\n"
+                ).encode()
+                + payload
+            )
 
-                bytes_read = 0
+            head = await reader.readuntil(b"\r\n\r\n")
 
-                over_limit = False
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            status = int(status_line.split()[1])
 
-                try:
-                    while not over_limit and not resp.content.at_eof():
-                        header = await resp.content.readexactly(header_size)
+            # 101 is returned for upgrade requests, older versions return 200
+            if status not in (101, 200):
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
 
-                        chunk_length = int.from_bytes(header[3:], byteorder="big")
-                        chunk = await resp.content.read(chunk_length)
+                content = await reader.readexactly(
+                    int(headers.get("content-length", 0))
+                )
+                self._docker_error(
+                    "POST", url, status, body, loads(content) if content else {}
+                )
+
+            yield reader, writer
+        finally:
+            writer.close()
 
-                        chunk_type = header[0]
-                        if chunk_type == 1:
-                            stdout += chunk
-                        elif chunk_type == 2:
-                            stderr += chunk
+    @staticmethod
+    async def write_stdin(writer: asyncio.StreamWriter, data: bytes) -> None:
+        """Writes data to hijacked connection and closes its write side."""
 
-                        bytes_read += chunk_length + header_size
-                        over_limit = bytes_read >= OUTPUT_LIMIT
+        try:
+            writer.write(data)
+            await writer.drain()
 
-                except asyncio.IncompleteReadError:
-                    pass
-                except Exception as e:
-                    log.error(f"error reading stream: {e}")
-                finally:
-                    return stdout, stderr, over_limit
+            writer.write_eof()
+        except OSError as e:  # program exited without reading everything
+            log.debug(f"stdin was not fully written: {e}")
+
+    async def read_output(
+        self,
+        reader: asyncio.StreamReader,
+        on_output: Optional[_OutputCallback] = None,
+        limits: Optional[OutputLimits] = None,
+    ) -> Tuple[HeadTailBuffer, HeadTailBuffer, bool, Dict[int, int]]:
+        """
+        Reads multiplexed attach stream. Returns stdout, stderr, over cap flag and bytes
+        read from each stream, buffers are empty if on_output is given.
+
+        Output between head and tail is drained and dropped until cap is reached.
+        Exceptions of on_output are raised, run should be aborted.
+        """
+
+        if limits is None:
+            limits = self._output_limits
+
+        demultiplexer = StreamDemultiplexer(total_limit=limits.cap)
+        output = {
+            STDOUT: HeadTailBuffer(limits.head, limits.tail),
+            STDERR: HeadTailBuffer(limits.head, limits.tail),
+        }
+
+        while True:
+            try:
+                chunk = await reader.read(READ_SIZE)
+            except OSError as e:
+                log.error(f"error reading stream: {e}")
+
+                break
+
+            if not chunk:
+                break
+
+            for stream_type, piece in demultiplexer.feed(chunk):
+                if on_output is not None:
+                    # next chunk is not read until piece is consumed
+                    await on_output(stream_type, bytes(piece))
+                elif stream_type in output:
+                    output[stream_type].write(piece)
+
+            if demultiplexer.over_limit:
+                break
+
+        return (
+            output[STDOUT],
+            output[STDERR],
+            demultiplexer.over_limit,
+            demultiplexer.received,
+        )
+
+    async def docker_request(
+        self,
+        method: str = "GET",
+        path: str = "",
+        params: Mapping[str, Any] = {},
+        body: Any = None,
+        data: Optional[bytes] = None,
+        raw: bool = False,
+        ignore_missing: bool = False,
+        observe_latency: bool = True,
+    ) -> Any:
+        async with self.docker_stream(
+            method, path, params, body, data, ignore_missing, observe_latency
+        ) as resp:
+            if resp is None:
+                return None
+
+            if raw:
+                return await resp.read()
 
             if resp.status == 204:
                 json = {}
             else:
                 json = await resp.json()
 
-            warnings = json.get("Warnings")
+            # list endpoints return arrays
+            warnings = json.get("Warnings") if isinstance(json, dict) else None
             if warnings:
                 log.warn(f"docker warning(s): {warnings}")
 
@@ -139,110 +679,865 @@ class DockerRunner:
 
     @property
     def busy(self) -> bool:
-        return self._running_containers >= self._max_containers
+        return self._admission.busy
+
+    @property
+    def max_containers(self) -> int:
+        return self._admission.slots
+
+    @property
+    def running(self) -> int:
+        return self._admission.running
+
+    @property
+    def draining(self) -> bool:
+        return self._admission.closed
+
+    async def drain(self, timeout: float) -> None:
+        """Stops accepting runs, waits up to timeout for running ones to finish."""
+
+        log.info("draining, %d runs in progress", self._admission.running)
+
+        self._admission.close()
+
+        deadline = time.monotonic() + timeout
+        while self._admission.running and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_INTERVAL)
+
+        if self._admission.running:
+            log.warning("drain timed out, %d runs in progress", self._admission.running)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            running_containers=self._admission.running,
+            max_containers=self._admission.slots,
+            admission=self._admission.stats(),
+            warm_pool=None if self._pool is None else self._pool.stats(),
+            compile_cache=None
+            if self._compile_cache is None
+            else self._compile_cache.stats(),
+            result_cache=None
+            if self._result_cache is None
+            else self._result_cache.stats(),
+            adaptive_containers=None
+            if self._concurrency is None
+            else self._concurrency.stats(),
+            reaper=None if self._reaper is None else self._reaper.stats(),
+            coalescing=None if self._coalescer is None else self._coalescer.stats(),
+            cpuset=None if self._cpuset is None else self._cpuset.stats(),
+            images=self.images.stats(),
+            usage=self._usage.stats(),
+        )
 
-    async def run_code(self, *args: Any, **kwargs: Any) -> _ResultType:
-        if self.busy:
-            raise web.HTTPServiceUnavailable(
-                reason="No free containers. Try again later"
+    def load(self) -> Dict[str, Any]:
+        return dict(
+            free_slots=0
+            if self.draining
+            else max(0, self._admission.slots - self._admission.used),
+            slots=self._admission.slots,
+            draining=self.draining,
+            queue_size=self._admission.queue_size,
+            max_queue_size=self._admission.max_queue_size,
+            warm_pool={} if self._pool is None else self._pool.ready(),
+        )
+
+    async def languages(self) -> List[str]:
+        """Returns languages with images present on docker host."""
+
+        return sorted(await self.images.present())
+
+    async def capacity(self) -> Dict[str, Any]:
+        """Returns load and languages this node is ready to run, advertised to others."""
+
+        return dict(self.load(), images=await self.languages())
+
+    def render_metrics(self) -> str:
+        self.metrics.running_containers.set(value=self._admission.running)
+        self.metrics.max_containers.set(value=self._admission.slots)
+
+        return self.metrics.render()
+
+    @staticmethod
+    def image_name(language: str) -> str:
+        return f"iomirea/run-lang-{language}"
+
+    async def inspect_image(self, language: str) -> Dict[str, Any]:
+        if language not in self._images:
+            self._images[language] = await self.docker_request(
+                "GET", f"images/{self.image_name(language)}/json"
             )
 
-        self._running_containers += 1
+        return self._images[language]
+
+    def forget_image(self, language: str) -> None:
+        """Drops information and warm containers of outdated image."""
+
+        self._images.pop(language, None)
+
+        if self._pool is not None:
+            self._pool.forget(language)
+
+    async def pull_image(self, language: str) -> Dict[str, Any]:
+        return await self.images.pull(language)
+
+    async def pull_images(
+        self, languages: Optional[Sequence[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        return await self.images.pull_all(languages)
+
+    def container_config(
+        self,
+        language: str,
+        env: List[str],
+        stdin: bool = False,
+        warm: bool = False,
+        cpu_slot: Optional[CpuSlot] = None,
+    ) -> Dict[str, Any]:
+        labels = {
+            LABEL_RUNNER: self._runner_id,
+            LABEL_INSTANCE: self._instance_id,
+            LABEL_LANGUAGE: language,
+            LABEL_CREATED: str(int(time.time())),
+        }
+        if warm:
+            labels[LABEL_WARM] = "1"
+
+        return {
+            "Env": env,
+            "Image": self.image_name(language),
+            "Labels": labels,
+            # stdin is closed after attached client closes it
+            "OpenStdin": stdin,
+            "StdinOnce": stdin,
+            "StopTimeout": 2,
+            "WorkingDir": "/sandbox",
+            "AutoRemove": False,
+            "NetworkMode": "none",
+            "NetworkDisabled": True,
+            "HealthCheck": {"Test": ("NONE",)},
+            "HostConfig": {
+                "Memory": self._max_ram,
+                "MemorySwap": self._max_ram,
+                "CpuQuota": int(self._max_cpu * CPU_PERIOD),
+                "CpuPeriod": CPU_PERIOD,
+                **self._cpuset_config(cpu_slot),
+            },
+        }
+
+    @staticmethod
+    def _cpuset_config(cpu_slot: Optional[CpuSlot]) -> Dict[str, str]:
+        if cpu_slot is None:
+            return {}
+
+        config = {"CpusetCpus": cpu_slot.cpus}
+        if cpu_slot.mems is not None:
+            config["CpusetMems"] = cpu_slot.mems
+
+        return config
+
+    async def abort_container(self, container_id: str) -> None:
+        """Kills container of run that can not continue, like after client left."""
+
         try:
-            return await self._run_container(*args, **kwargs)
-        finally:
-            self._running_containers -= 1
+            await self.docker_request(
+                "POST", f"containers/{container_id}/kill", observe_latency=False
+            )
+        except web.HTTPException:  # already logged by docker_request
+            pass
 
-    async def _run_container(
+    async def remove_container(self, container_id: str) -> None:
+        await self.docker_request(
+            "DELETE",
+            f"containers/{container_id}",
+            {"v": 1, "force": 1},
+            ignore_missing=True,
+        )
+
+    def schedule_removal(self, container_id: str, language: str) -> None:
+        """Removes container in background, outside of run critical path."""
+
+        self._removal_queue.put_nowait((container_id, language))
+
+    async def _removal_worker(self) -> None:
+        while True:
+            container_id, language = await self._removal_queue.get()
+
+            try:
+                with self.metrics.docker_phase_seconds.time("delete", language):
+                    await self.remove_container(container_id)
+            except web.HTTPException:  # already logged by docker_request
+                pass
+            except (aiohttp.ClientError, OSError) as e:
+                log.warning(f"unable to remove container {container_id}: {e!r}")
+            finally:
+                self._removal_queue.task_done()
+
+    async def put_files(
+        self, container_id: str, files: Dict[str, bytes], path: str = "/sandbox"
+    ) -> None:
+        directories = {os.path.dirname(name) for name in files if os.path.dirname(name)}
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for name in sorted(directories):
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+
+                tar.addfile(info)
+
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mode = 0o755
+
+                tar.addfile(info, io.BytesIO(content))
+
+        await self.docker_request(
+            "PUT",
+            f"containers/{container_id}/archive",
+            {"path": path},
+            data=archive.getvalue(),
+            # time of transfer grows with size of files
+            observe_latency=False,
+        )
+
+    async def get_files(
+        self, container_id: str, path: str
+    ) -> Optional[Dict[str, bytes]]:
+        """Returns regular files at path. Names are relative to parent of path."""
+
+        archive = await self.docker_request(
+            "GET",
+            f"containers/{container_id}/archive",
+            {"path": path},
+            raw=True,
+            ignore_missing=True,
+            observe_latency=False,
+        )
+        if archive is None:
+            return None
+
+        files = {}
+
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                extracted = tar.extractfile(member)
+                if extracted is not None:
+                    files[member.name] = extracted.read()
+
+        return files
+
+    async def run_code(
         self,
         language: str,
         code: str,
         input: Optional[str],
         compile_commands: List[str],
         merge_output: bool,
+        on_output: Optional[_OutputCallback] = None,
+        priority: int = 0,
+        output_head: Optional[int] = None,
+        output_tail: Optional[int] = None,
+        output_cap: Optional[int] = None,
     ) -> _ResultType:
-        with configure_scope() as scope:
-            scope.set_tag("language", language)
+        """Output limits can be lowered from configured ones."""
+
+        limits = self._output_limits.lowered(output_head, output_tail, output_cap)
+
+        result_cache_key = None
+        if self._result_cache is not None and on_output is None:
+            image = await self.inspect_image(language)
+            result_cache_key = ResultCache.make_key(
+                image["Id"],
+                language,
+                code,
+                input,
+                compile_commands,
+                merge_output,
+                (limits.head, limits.tail, limits.cap),
+            )
+
+            cached = await self._result_cache.get(result_cache_key)
+            if cached is not None:
+                cached["result_cache_hit"] = True
+                cached["coalesced"] = False
+
+                return cached
+
+        async def run() -> _ResultType:
+            async with self._container_slot(priority, language) as cpu_slot:
+                result = await self._run_container(
+                    language,
+                    code,
+                    input,
+                    compile_commands,
+                    merge_output,
+                    on_output,
+                    limits,
+                    cpu_slot,
+                )
+
+            result["result_cache_hit"] = False
+
+            # docker errors are raised, timed out runs and runs of outdated images
+            # that do not report timeouts are not cached
+            if result_cache_key is not None and result["timed_out"] is False:
+                assert self._result_cache is not None
+
+                await self._result_cache.set(result_cache_key, result)
+
+            return result
+
+        # streamed output can not be shared
+        if self._coalescer is None or on_output is not None:
+            return dict(await run(), coalesced=False)
+
+        result, coalesced = await self._coalescer.run(
+            (
+                language,
+                code,
+                input,
+                tuple(compile_commands),
+                merge_output,
+                (limits.head, limits.tail, limits.cap),
+            ),
+            run,
+        )
+        if coalesced:
+            self.metrics.coalesced_runs.inc(language)
+
+        # result is shared between callers
+        return dict(result, coalesced=coalesced)
+
+    async def run_batch(
+        self,
+        language: str,
+        code: str,
+        cases: List[Dict[str, Any]],
+        compile_commands: List[str],
+        merge_output: bool,
+        priority: int = 0,
+        output_head: Optional[int] = None,
+        output_tail: Optional[int] = None,
+        output_cap: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Compiles code once and runs it with each case input in the same container.
+
+        Case can have input, timeout and output_limit keys. Output limits apply to
+        output of container itself, such as compilation errors.
+        """
+
+        if not 0 < len(cases) <= MAX_BATCH_CASES:
+            raise web.HTTPBadRequest(
+                reason=f"Number of cases should be between 1 and {MAX_BATCH_CASES}"
+            )
+
+        default_output_limit = min(OUTPUT_LIMIT, BATCH_OUTPUT_LIMIT // len(cases))
+
+        timeouts = []
+        output_limits = []
+        files = {}
+
+        for i, case in enumerate(cases):
+            timeouts.append(min(case.get("timeout") or EXEC_TIMEOUT, EXEC_TIMEOUT))
+            output_limits.append(
+                int(min(case.get("output_limit") or default_output_limit, OUTPUT_LIMIT))
+            )
+
+            input = case.get("input") or ""
+            if input and not input.endswith("\n"):
+                input += "\n"
+
+            files[f"batch_input/{i}"] = input.encode()
+
+        if sum(timeouts) > BATCH_TIMEOUT:
+            raise web.HTTPBadRequest(
+                reason=f"Sum of case timeouts should not exceed {BATCH_TIMEOUT}"
+            )
+
+        if sum(output_limits) > BATCH_OUTPUT_LIMIT:
+            raise web.HTTPBadRequest(
+                reason=f"Sum of case output limits should not exceed {BATCH_OUTPUT_LIMIT}"
+            )
+
+        env = [
+            f"CASES={len(cases)}",
+            f"CASE_TIMEOUTS={' '.join(map(str, timeouts))}",
+            f"CASE_OUTPUT_LIMITS={' '.join(map(str, output_limits))}",
+        ]
+
+        async with self._container_slot(priority, language) as cpu_slot:
+            result, collected = await self._execute(
+                language,
+                code,
+                compile_commands,
+                merge_output,
+                env,
+                files,
+                [BATCH_OUTPUT_PATH],
+                None,
+                self._output_limits.lowered(output_head, output_tail, output_cap),
+                # compilation is limited by EXEC_TIMEOUT
+                timeout=EXEC_TIMEOUT + sum(timeouts),
+                cpu_slot=cpu_slot,
+            )
+
+        outputs = collected.get(BATCH_OUTPUT_PATH, {})
+
+        case_results = []
+        for i in range(len(cases)):
+            exit_code = outputs.get(f"batch_output/{i}.code")
+            exec_time = outputs.get(f"batch_output/{i}.time")
+
+            case_results.append(
+                dict(
+                    stdout=outputs.get(f"batch_output/{i}.out", b"").decode(
+                        errors="replace"
+                    ),
+                    stderr=outputs.get(f"batch_output/{i}.err", b"").decode(
+                        errors="replace"
+                    ),
+                    # case was not run if compilation failed or batch timed out
+                    exit_code=None if exit_code is None else int(exit_code),
+                    exec_time=None if exec_time is None else int(exec_time) / 1e9,
+                )
+            )
+
+        return dict(result, cases=case_results)
 
-        env = [f"CODE={code}", f"TIMEOUT={EXEC_TIMEOUT}"]
-        if compile_commands:
-            env.append(f"COMPILE_COMMAND={' && '.join(compile_commands)}")
+    @asynccontextmanager
+    async def _container_slot(
+        self, priority: int, language: str
+    ) -> AsyncIterator[Optional[CpuSlot]]:
+        """Yields dedicated cpus for container if cpuset is configured."""
 
+        acquired_at = await self._admission.acquire(priority, language)
+
+        if self._concurrency is not None:
+            self._concurrency.observe_admission()
+
+        try:
+            if self._cpuset is None:
+                yield None
+            else:
+                cpu_slot = self._cpuset.acquire()
+                try:
+                    yield cpu_slot
+                finally:
+                    self.metrics.cpuset_busy_seconds.inc(
+                        cpu_slot.cpus, amount=self._cpuset.release(cpu_slot)
+                    )
+        finally:
+            self._admission.release(acquired_at, language)
+
+    async def _run_container(
+        self,
+        language: str,
+        code: str,
+        input: Optional[str],
+        compile_commands: List[str],
+        merge_output: bool,
+        on_output: Optional[_OutputCallback],
+        output_limits: OutputLimits,
+        cpu_slot: Optional[CpuSlot],
+    ) -> _ResultType:
+        stdin = None
         if input is not None:
             if not input.endswith("\n"):
                 input += "\n"
-            env.append(f"INPUT={input}")
+            stdin = input.encode()
+
+        result, _ = await self._execute(
+            language,
+            code,
+            compile_commands,
+            merge_output,
+            [],
+            {},
+            [],
+            on_output,
+            output_limits,
+            stdin=stdin,
+            cpu_slot=cpu_slot,
+        )
+
+        return result
+
+    async def _execute(
+        self,
+        language: str,
+        code: str,
+        compile_commands: List[str],
+        merge_output: bool,
+        env: List[str],
+        files: Dict[str, bytes],
+        collect_paths: List[str],
+        on_output: Optional[_OutputCallback],
+        output_limits: OutputLimits,
+        timeout: float = EXEC_TIMEOUT,
+        stdin: Optional[bytes] = None,
+        cpu_slot: Optional[CpuSlot] = None,
+    ) -> Tuple[_ResultType, Dict[str, Dict[str, bytes]]]:
+        """
+        Runs code in container, returns result and files at collect_paths.
+
+        Code and files are uploaded to /sandbox before running, stdin is written to
+        attached connection. Program stdin is empty if stdin is None. Container is
+        pinned to cpus of cpu_slot. With compile cache code that is not in cache is
+        compiled in separate container first.
+        """
+
+        with configure_scope() as scope:
+            scope.set_tag("language", language)
+
+        env = [f"TIMEOUT={timeout}", f"RUN_STATS_PATH={RUN_STATS_PATH}", *env]
+        files = dict(files)
+        collect_paths = [*collect_paths, RUN_STATS_PATH]
 
         if merge_output:
             env.append("MERGE_OUTPUT=1")
 
-        try:
-            create_result = await self.docker_request(
-                "POST",
-                "containers/create",
-                body={
-                    "Env": env,
-                    "Image": f"iomirea/run-lang-{language}",
-                    "StopTimeout": 2,
-                    "WorkingDir": "/sandbox",
-                    "AutoRemove": False,
-                    "NetworkMode": "none",
-                    "NetworkDisabled": True,
-                    "HealthCheck": {"Test": ("NONE",)},
-                    "HostConfig": {
-                        "Memory": self._max_ram,
-                        "MemorySwap": self._max_ram,
-                        "CpuQuota": CPU_QUOTA,
-                        "CpuPeriod": int(self._max_cpu * CPU_QUOTA),
-                    },
-                },
+        binary = None
+        compile_cache_key = None
+
+        if self._compile_cache is not None and compile_commands:
+            image = await self.inspect_image(language)
+            compile_cache_key = CompileCache.make_key(
+                image["Id"], compile_commands, code
             )
-            new_id = create_result["Id"]
 
-            await self.docker_request("POST", f"containers/{new_id}/start")
+            binary = await self._compile_cache.get(compile_cache_key)
 
-            async def kill_container(delay: int) -> None:
-                await asyncio.sleep(delay)
-                await self.docker_request("POST", f"containers/{new_id}/stop")
+        compile_cache_hit = binary is not None
+
+        compile_result = compile_usage = None
+        if compile_cache_key is not None and binary is None:
+            compile_result, compile_usage, binary = await self._compile(
+                language,
+                code,
+                compile_commands,
+                merge_output,
+                on_output,
+                output_limits,
+                timeout,
+                cpu_slot,
+            )
 
-            kill_task = asyncio.create_task(kill_container(EXEC_TIMEOUT + 2))
+            if binary is not None:
+                assert self._compile_cache is not None
+
+                await self._compile_cache.put(compile_cache_key, binary)
+
+        collected: Dict[str, Dict[str, bytes]] = {}
+
+        if compile_usage is not None and binary is None:
+            # compilation failed, there is nothing to run
+            assert compile_result is not None
+
+            result, usage = compile_result, compile_usage
+        else:
+            if binary is not None:
+                files["exec_input"] = binary
+                env.append("PRECOMPILED=1")
+            elif compile_commands:
+                files["compile_input"] = code.encode()
+                env.append(f"COMPILE_COMMAND={' && '.join(compile_commands)}")
+            else:
+                files["exec_input"] = code.encode()
+
+            warm_container = None
+            if self._pool is not None:
+                warm_container = self._pool.acquire(language)
+
+            reused = warm_container is not None and warm_container.runs > 0
+
+            if warm_container is None:
+                result, collected = await self._run_cold_container(
+                    language,
+                    env,
+                    files,
+                    collect_paths,
+                    on_output,
+                    output_limits,
+                    timeout,
+                    stdin,
+                    cpu_slot,
+                )
+            else:
+                result, collected = await self._run_warm_container(
+                    warm_container,
+                    env,
+                    files,
+                    collect_paths,
+                    on_output,
+                    output_limits,
+                    timeout,
+                    stdin,
+                    cpu_slot,
+                )
 
-            stdout, stderr, over_limit = await self.docker_request(
-                "POST",
-                f"containers/{new_id}/attach",
-                {"logs": 1, "stream": 1, "stdout": 1, "stderr": 1},
-                stream=True,
+            usage = parse_usage(
+                collected.pop(RUN_STATS_PATH, {}),
+                bool(compile_commands) and binary is None,
             )
+            if reused:
+                # cgroup peak includes previous runs
+                usage["peak_memory"] = None
 
-            if over_limit:
-                await kill_container(0)
+            if compile_usage is not None:
+                assert compile_result is not None
 
-            await self.docker_request("POST", f"containers/{new_id}/wait")
-            kill_task.cancel()
+                usage["compile_time"] = compile_usage["compile_time"]
+                result["exec_time"] += compile_result["exec_time"]
+
+        self._observe_usage(language, usage)
+
+        result.update(usage)
+        result["compile_cache_hit"] = compile_cache_hit
+
+        if cpu_slot is not None:
+            cpu_slot.observe_exec_time(float(result["exec_time"]))
+
+        self.metrics.runs.inc(language)
+        if result["timed_out"]:
+            self.metrics.timeouts.inc(language)
+
+        return result, collected
+
+    async def _compile(
+        self,
+        language: str,
+        code: str,
+        compile_commands: List[str],
+        merge_output: bool,
+        on_output: Optional[_OutputCallback],
+        output_limits: OutputLimits,
+        timeout: float,
+        cpu_slot: Optional[CpuSlot],
+    ) -> Tuple[_ResultType, Dict[str, Union[int, float, bool, None]], Optional[bytes]]:
+        """
+        Compiles code in container of its own, returns result, usage and binary.
+
+        Binary is collected after container exited: program runs in another container
+        and can not replace binary that goes to compile cache. Binary is None if
+        compilation failed.
+        """
+
+        env = [
+            f"TIMEOUT={timeout}",
+            f"RUN_STATS_PATH={RUN_STATS_PATH}",
+            f"COMPILE_COMMAND={' && '.join(compile_commands)}",
+            "COMPILE_ONLY=1",
+        ]
+        if merge_output:
+            env.append("MERGE_OUTPUT=1")
+
+        result, collected = await self._run_cold_container(
+            language,
+            env,
+            {"compile_input": code.encode()},
+            [EXEC_INPUT_PATH, RUN_STATS_PATH],
+            on_output,
+            output_limits,
+            timeout,
+            None,
+            cpu_slot,
+        )
 
-            inspect_result = await self.docker_request(
-                "GET", f"containers/{new_id}/json"
+        binary = None
+        if result["exit_code"] == 0:
+            binary = collected.get(EXEC_INPUT_PATH, {}).get(
+                os.path.basename(EXEC_INPUT_PATH)
             )
-            state = inspect_result["State"]
-            started_at = state["StartedAt"]
-            finished_at = state["FinishedAt"]
 
-            def parse_datetime_ns(inp: str) -> float:
-                """Converts iso formatted string with nanoseconds precision to float."""
+        return result, parse_usage(collected.get(RUN_STATS_PATH, {}), True), binary
+
+    @staticmethod
+    def _output_result(
+        stdout: HeadTailBuffer, stderr: HeadTailBuffer, over_cap: bool
+    ) -> Dict[str, Any]:
+        return dict(
+            stdout=stdout.decode(),
+            stderr=stderr.decode(),
+            # bytes dropped between head and tail
+            stdout_dropped=stdout.dropped,
+            stderr_dropped=stderr.dropped,
+            # program was killed, output after cap is not counted
+            output_cap_exceeded=over_cap,
+        )
+
+    def _observe_output(
+        self, language: str, received: Dict[int, int], over_limit: bool
+    ) -> None:
+        self.metrics.output_bytes.observe(received[STDOUT], language, "stdout")
+        self.metrics.output_bytes.observe(received[STDERR], language, "stderr")
+
+        if over_limit:
+            self.metrics.output_limit_kills.inc(language)
+
+    def _observe_usage(
+        self, language: str, usage: Dict[str, Union[int, float, bool, None]]
+    ) -> None:
+        self._usage.observe(language, usage)
+
+        for phase in ("compile", "execute"):
+            value = usage[f"{phase}_time"]
+            if value is not None:
+                self.metrics.run_phase_seconds.observe(value, phase, language)
+
+        for mode in ("user", "system"):
+            value = usage[f"cpu_{mode}_time"]
+            if value is not None:
+                self.metrics.cpu_seconds.observe(value, mode, language)
+
+        if usage["peak_memory"] is not None:
+            self.metrics.peak_memory_bytes.observe(usage["peak_memory"], language)
+
+        if usage["oom_killed"]:
+            self.metrics.oom_kills.inc(language)
+
+    async def _collect(
+        self, container_id: str, paths: List[str]
+    ) -> Dict[str, Dict[str, bytes]]:
+        collected = {}
+        for path in paths:
+            files = await self.get_files(container_id, path)
+            if files is not None:
+                collected[path] = files
+
+        return collected
+
+    async def _run_cold_container(
+        self,
+        language: str,
+        env: List[str],
+        files: Dict[str, bytes],
+        collect_paths: List[str],
+        on_output: Optional[_OutputCallback],
+        output_limits: OutputLimits,
+        timeout: float,
+        stdin: Optional[bytes],
+        cpu_slot: Optional[CpuSlot],
+    ) -> Tuple[_ResultType, Dict[str, Dict[str, bytes]]]:
+        phase = self.metrics.docker_phase_seconds.time
+
+        try:
+            create_started_at = time.monotonic()
+
+            with phase("create", language):
+                create_result = await self.docker_request(
+                    "POST",
+                    "containers/create",
+                    body=self.container_config(
+                        language, env, stdin is not None, cpu_slot=cpu_slot
+                    ),
+                )
+            new_id = create_result["Id"]
+
+            with phase("upload", language):
+                await self.put_files(new_id, files)
+
+            async with AsyncExitStack() as stack:
+                # both wait and attach are established before start: output of fast
+                # programs is not missed and exit code is known without inspecting
+                with phase("attach", language):
+                    wait_resp, (reader, writer) = await asyncio.gather(
+                        stack.enter_async_context(
+                            self.docker_stream(
+                                "POST",
+                                f"containers/{new_id}/wait",
+                                {"condition": "next-exit"},
+                                observe_latency=False,
+                            )
+                        ),
+                        stack.enter_async_context(
+                            self.docker_hijack(
+                                f"containers/{new_id}/attach",
+                                {
+                                    "stream": 1,
+                                    "stdin": int(stdin is not None),
+                                    "stdout": 1,
+                                    "stderr": 1,
+                                },
+                            )
+                        ),
+                    )
+
+                assert wait_resp is not None
+
+                async def wait_exit() -> Tuple[Dict[str, Any], float]:
+                    assert wait_resp is not None
+
+                    return await wait_resp.json(), time.monotonic()
+
+                with phase("start", language):
+                    await self.docker_request("POST", f"containers/{new_id}/start")
+
+                started_at = time.monotonic()
+
+                if self._concurrency is not None:
+                    self._concurrency.observe_start_time(started_at - create_started_at)
+
+                wait_task = asyncio.create_task(wait_exit())
 
-                dot_index = inp.rindex(".")
-                datetime_no_ms = inp[:dot_index]
-                ms_and_ns = float(inp[dot_index:-1])
+                stdin_task = None
+                if stdin is not None:
+                    stdin_task = asyncio.create_task(self.write_stdin(writer, stdin))
 
-                return datetime.fromisoformat(datetime_no_ms).timestamp() + ms_and_ns
+                async def kill_container(delay: float) -> None:
+                    await asyncio.sleep(delay)
+                    await self.docker_request(
+                        "POST", f"containers/{new_id}/stop", observe_latency=False
+                    )
 
-            exec_time = parse_datetime_ns(finished_at) - parse_datetime_ns(started_at)
+                kill_task = asyncio.create_task(kill_container(timeout + 2))
 
-            return dict(
-                stdout=stdout.decode(errors="replace"),
-                stderr=stderr.decode(errors="replace"),
-                exit_code=state["ExitCode"],
-                exec_time=exec_time,
+                try:
+                    try:
+                        with phase("output", language):
+                            (
+                                stdout,
+                                stderr,
+                                over_limit,
+                                received,
+                            ) = await self.read_output(reader, on_output, output_limits)
+                    except Exception:
+                        await self.abort_container(new_id)
+
+                        raise
+
+                    self._observe_output(language, received, over_limit)
+
+                    if over_limit:
+                        with phase("stop", language):
+                            await kill_container(0)
+
+                    with phase("wait", language):
+                        wait_result, exited_at = await wait_task
+                finally:
+                    kill_task.cancel()
+                    wait_task.cancel()
+
+                    if stdin_task is not None:
+                        stdin_task.cancel()
+
+            with phase("collect", language):
+                collected = await self._collect(new_id, collect_paths)
+
+            return (
+                dict(
+                    self._output_result(stdout, stderr, over_limit),
+                    exit_code=wait_result["StatusCode"],
+                    # time between start response and wait response, includes
+                    # docker api latency
+                    exec_time=exited_at - started_at,
+                ),
+                collected,
             )
         finally:
             try:
@@ -250,11 +1545,149 @@ class DockerRunner:
             except UnboundLocalError:  # not yet defined
                 log.warn("container not created, skipping deletion")
             else:
+                self.schedule_removal(new_id, language)
+
+    async def _run_warm_container(
+        self,
+        container: WarmContainer,
+        env: List[str],
+        files: Dict[str, bytes],
+        collect_paths: List[str],
+        on_output: Optional[_OutputCallback],
+        output_limits: OutputLimits,
+        timeout: float,
+        stdin: Optional[bytes],
+        cpu_slot: Optional[CpuSlot],
+    ) -> Tuple[_ResultType, Dict[str, Dict[str, bytes]]]:
+        assert self._pool is not None
+
+        phase = self.metrics.docker_phase_seconds.time
+        language = container.language
+
+        # killed containers and runs over output limit are not reused
+        clean = False
+
+        try:
+            if cpu_slot is not None:
+                with phase("update", language):
+                    await self.docker_request(
+                        "POST",
+                        f"containers/{container.id}/update",
+                        body=self._cpuset_config(cpu_slot),
+                    )
+
+            with phase("upload", language):
+                await self.put_files(container.id, files)
+
+            exec_config = {
+                "Cmd": await self._pool.command(language),
+                "Env": env,
+                "WorkingDir": "/sandbox",
+                "AttachStdin": stdin is not None,
+                "AttachStdout": True,
+                "AttachStderr": True,
+            }
+            if self._pool.reuses(language):
+                exec_config["User"] = REUSE_USER
+
+            with phase("exec_create", language):
+                exec_result = await self.docker_request(
+                    "POST", f"containers/{container.id}/exec", body=exec_config
+                )
+            exec_id = exec_result["Id"]
+
+            killed = False
+
+            async def kill_container(delay: float) -> None:
+                nonlocal killed
+
+                await asyncio.sleep(delay)
+
+                killed = True
                 await self.docker_request(
-                    "DELETE", f"containers/{new_id}", {"v": 1, "force": 1}
+                    "POST", f"containers/{container.id}/kill", observe_latency=False
                 )
 
+            kill_task = asyncio.create_task(kill_container(timeout + 2))
+
+            started_at = time.monotonic()
+
+            with phase("exec", language):
+                async with self.docker_hijack(
+                    f"exec/{exec_id}/start", body={"Detach": False, "Tty": False}
+                ) as (reader, writer):
+                    stdin_task = None
+                    if stdin is not None:
+                        stdin_task = asyncio.create_task(
+                            self.write_stdin(writer, stdin)
+                        )
+
+                    try:
+                        (
+                            stdout,
+                            stderr,
+                            over_limit,
+                            received,
+                        ) = await self.read_output(reader, on_output, output_limits)
+                    except Exception:
+                        kill_task.cancel()
+
+                        # container is not clean and is discarded on release
+                        await self.abort_container(container.id)
+
+                        raise
+                    finally:
+                        if stdin_task is not None:
+                            stdin_task.cancel()
+
+            exec_time = time.monotonic() - started_at
+
+            self._observe_output(language, received, over_limit)
+
+            if over_limit:
+                with phase("kill", language):
+                    await kill_container(0)
+
+            # exec is recorded as exited some time after its output ends, program can
+            # also close output and keep running until it is killed on timeout
+            with phase("exec_inspect", language):
+                while True:
+                    was_killed = killed
+
+                    inspect_result = await self.docker_request(
+                        "GET", f"exec/{exec_id}/json"
+                    )
+                    if not inspect_result["Running"] or was_killed:
+                        break
+
+                    await asyncio.sleep(EXEC_POLL_INTERVAL)
+
+            kill_task.cancel()
+
+            exit_code = inspect_result["ExitCode"]
+
+            with phase("collect", language):
+                collected = await self._collect(container.id, collect_paths)
+
+            clean = not killed and exit_code is not None
+
+            return (
+                dict(
+                    self._output_result(stdout, stderr, over_limit),
+                    # process is killed together with container and might not have
+                    # exit code set yet, exec that is not killed has one
+                    exit_code=137 if exit_code is None else exit_code,
+                    exec_time=exec_time,
+                ),
+                collected,
+            )
+        finally:
+            # only containers of reused languages are reset and run code again
+            self._pool.release(container, clean)
+
     def calculate_optimal_container_count(self) -> int:
-        # TODO
+        count = optimal_container_count(self._max_ram, self._max_cpu)
+
+        log.info("calculated optimal container count: %d", count)
 
-        return 6
+        return count
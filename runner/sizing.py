@@ -0,0 +1,206 @@
+import os
+import math
+import asyncio
+import logging
+
+from typing import Any, Dict, List, Optional
+
+from .admission import AdmissionQueue
+
+log = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# memory left for host and runner itself
+MEMORY_RESERVE = 256 * 1024 * 1024
+
+# cgroup v1 reports this or bigger value when memory is not limited
+CGROUP_V1_UNLIMITED = 1 << 60
+
+
+def _read_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read_file(os.path.join(CGROUP_ROOT, "cpu.max"))
+    if cpu_max is not None:
+        quota, period = cpu_max.split()
+        if quota == "max":
+            return None
+
+        return int(quota) / int(period)
+
+    # cgroup v1
+    cfs_quota = _read_file(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_quota_us"))
+    cfs_period = _read_file(os.path.join(CGROUP_ROOT, "cpu", "cpu.cfs_period_us"))
+    if cfs_quota is None or cfs_period is None or int(cfs_quota) <= 0:
+        return None
+
+    return int(cfs_quota) / int(cfs_period)
+
+
+def _cgroup_memory_limit() -> Optional[int]:
+    memory_max = _read_file(os.path.join(CGROUP_ROOT, "memory.max"))
+    if memory_max is not None:
+        return None if memory_max == "max" else int(memory_max)
+
+    limit = _read_file(os.path.join(CGROUP_ROOT, "memory", "memory.limit_in_bytes"))
+    if limit is None or int(limit) >= CGROUP_V1_UNLIMITED:
+        return None
+
+    return int(limit)
+
+
+def available_cpus() -> float:
+    try:
+        cpus: float = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on some platforms
+        cpus = os.cpu_count() or 1
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, limit)
+
+    return cpus
+
+
+def available_memory() -> Optional[int]:
+    memory = None
+
+    meminfo = _read_file("/proc/meminfo")
+    if meminfo is not None:
+        for line in meminfo.splitlines():
+            name, value = line.split(":", 1)
+            if name == "MemTotal":
+                memory = int(value.split()[0]) * 1024
+                break
+
+    limit = _cgroup_memory_limit()
+    if limit is not None:
+        memory = limit if memory is None else min(memory, limit)
+
+    return memory
+
+
+def optimal_container_count(max_ram: int, max_cpu: float) -> int:
+    """Calculates how many containers with given limits host can run at once."""
+
+    counts = [available_cpus() / max_cpu]
+
+    memory = available_memory()
+    if max_ram and memory is not None:
+        counts.append((memory - MEMORY_RESERVE) / max_ram)
+
+    return max(1, math.floor(min(counts)))
+
+
+class ConcurrencyController:
+    """
+    Adjusts number of admission slots using AIMD.
+
+    Slot count is increased by 1 when all slots are used and docker responds fast,
+    multiplied by backoff factor when docker api latency or container start time
+    exceeds limit.
+    """
+
+    def __init__(
+        self,
+        admission: AdmissionQueue,
+        min_slots: int,
+        max_slots: int,
+        max_api_latency: float,
+        max_start_time: float,
+        interval: float = 5,
+        backoff: float = 0.75,
+    ):
+        self._admission = admission
+        self._min_slots = min_slots
+        self._max_slots = max_slots
+        self._max_api_latency = max_api_latency
+        self._max_start_time = max_start_time
+        self._interval = interval
+        self._backoff = backoff
+
+        self._api_latencies: List[float] = []
+        self._start_times: List[float] = []
+
+        self._saturated = False
+
+        self._increases = 0
+        self._decreases = 0
+
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def observe_api_latency(self, latency: float) -> None:
+        self._api_latencies.append(latency)
+
+    def observe_start_time(self, start_time: float) -> None:
+        self._start_times.append(start_time)
+
+    def observe_admission(self) -> None:
+        if self._admission.used >= self._admission.slots:
+            self._saturated = True
+
+    @staticmethod
+    def _mean(samples: List[float]) -> float:
+        return sum(samples) / len(samples) if samples else 0
+
+    def _adjust(self) -> None:
+        api_latency = self._mean(self._api_latencies)
+        start_time = self._mean(self._start_times)
+
+        slots = self._admission.slots
+
+        if api_latency > self._max_api_latency or start_time > self._max_start_time:
+            new_slots = max(self._min_slots, math.floor(slots * self._backoff))
+        elif self._saturated:
+            new_slots = min(self._max_slots, slots + 1)
+        else:
+            new_slots = slots
+
+        if new_slots != slots:
+            log.debug(
+                "changing slots %d -> %d (api latency %.3f, start time %.3f)",
+                slots,
+                new_slots,
+                api_latency,
+                start_time,
+            )
+
+            if new_slots > slots:
+                self._increases += 1
+            else:
+                self._decreases += 1
+
+            self._admission.slots = new_slots
+
+        self._api_latencies.clear()
+        self._start_times.clear()
+        self._saturated = self._admission.used >= self._admission.slots
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+
+            self._adjust()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            min_slots=self._min_slots,
+            max_slots=self._max_slots,
+            increases=self._increases,
+            decreases=self._decreases,
+        )
@@ -0,0 +1,165 @@
+from typing import Dict, List, Tuple, Union, Optional
+
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+
+HEADER_SIZE = 8
+
+_Piece = Tuple[int, memoryview]
+
+
+class StreamDemultiplexer:
+    """
+    Incremental parser of docker multiplexed attach stream.
+
+    Every frame starts with 8 byte header: stream type, 3 zero bytes and big endian
+    payload size. Data can be fed in chunks of any size, frames split between chunks
+    are handled. Returned pieces reference fed data without copying it.
+    """
+
+    def __init__(
+        self, stream_limit: Optional[int] = None, total_limit: Optional[int] = None
+    ):
+        self._stream_limit = stream_limit
+        self._total_limit = total_limit
+
+        self._header = bytearray()
+        self._stream_type = STDOUT
+        self._remaining = 0
+
+        self.received: Dict[int, int] = {STDOUT: 0, STDERR: 0}
+        self.total_received = 0
+
+        self.over_limit = False
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> List[_Piece]:
+        view = memoryview(data)
+        end = len(view)
+        position = 0
+
+        pieces: List[_Piece] = []
+
+        while position < end and not self.over_limit:
+            if self._remaining == 0:
+                missing = HEADER_SIZE - len(self._header)
+
+                self._header += view[position : position + missing]
+                position += missing
+
+                if len(self._header) < HEADER_SIZE:
+                    break
+
+                self._stream_type = self._header[0]
+                self._remaining = int.from_bytes(self._header[4:], byteorder="big")
+
+                self._header.clear()
+
+                continue
+
+            size = min(self._remaining, end - position)
+            piece = self._apply_limits(view[position : position + size])
+
+            position += size
+            self._remaining -= size
+
+            if piece:
+                pieces.append((self._stream_type, piece))
+
+        return pieces
+
+    def _apply_limits(self, piece: memoryview) -> memoryview:
+        allowed = len(piece)
+
+        received = self.received.get(self._stream_type, 0)
+        if self._stream_limit is not None:
+            allowed = min(allowed, self._stream_limit - received)
+
+        if self._total_limit is not None:
+            allowed = min(allowed, self._total_limit - self.total_received)
+
+        if allowed < len(piece):
+            self.over_limit = True
+            piece = piece[:allowed]
+
+        self.received[self._stream_type] = received + allowed
+        self.total_received += allowed
+
+        return piece
+
+
+class HeadTailBuffer:
+    """
+    Keeps first head and last tail bytes written, bytes in between are counted and
+    dropped. Memory used is bounded by head + 2 * tail bytes.
+    """
+
+    def __init__(self, head: int, tail: int):
+        self._head_size = head
+        self._tail_size = tail
+
+        self.head = bytearray()
+        self._tail = bytearray()
+
+        self.received = 0
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        self.received += len(data)
+
+        missing = self._head_size - len(self.head)
+        if missing > 0:
+            self.head += data[:missing]
+            data = data[missing:]
+
+        if not data or not self._tail_size:
+            return
+
+        self._tail += data[-self._tail_size :]
+
+        # trimmed once tail doubles instead of moving bytes on every write
+        if len(self._tail) > 2 * self._tail_size:
+            del self._tail[: -self._tail_size]
+
+    @property
+    def tail(self) -> bytearray:
+        if not self._tail_size:
+            return bytearray()
+
+        return self._tail[-self._tail_size :]
+
+    @property
+    def dropped(self) -> int:
+        return self.received - len(self.head) - len(self.tail)
+
+    def decode(self) -> str:
+        if not self.dropped:
+            return (self.head + self.tail).decode(errors="replace")
+
+        # decoded separately, characters can be split at the gap
+        return self.head.decode(errors="replace") + self.tail.decode(errors="replace")
+
+
+class OutputLimits:
+    """
+    Bytes of each stream kept from start (head) and end (tail) and total bytes read
+    from all streams before program is killed (cap).
+    """
+
+    def __init__(self, head: int, tail: int, cap: int):
+        self.head = head
+        self.tail = tail
+        self.cap = cap
+
+    def lowered(
+        self,
+        head: Optional[int] = None,
+        tail: Optional[int] = None,
+        cap: Optional[int] = None,
+    ) -> "OutputLimits":
+        """Returns limits with values lowered to given ones."""
+
+        return OutputLimits(
+            self.head if head is None else min(head, self.head),
+            self.tail if tail is None else min(tail, self.tail),
+            self.cap if cap is None else min(cap, self.cap),
+        )
@@ -1,181 +1,224 @@
-import time
+import os
+import signal
 import asyncio
 import logging
 
-from typing import Dict, Optional
+from types import TracebackType
+from typing import List, Type, Tuple, Optional, AsyncIterator
+
+from .stream import STDERR, STDOUT, HeadTailBuffer
 
 log = logging.getLogger(__name__)
 
-DEFAULT_READ_LIMIT = 1024 * 1024
-MIN_CHUNK_SIZE = 100
+# bytes of each stream kept from start and end of output
+DEFAULT_HEAD = 512 * 1024
+DEFAULT_TAIL = 512 * 1024
 
+CHUNK_SIZE = 64 * 1024
 
-class ShellResult:
-    def __init__(self, process: asyncio.subprocess.Process, finally_kill: bool = True):
-        self._process = process
-        self._finally_kill = finally_kill
+# chunks read ahead of consumer, pipes are not read further until consumer catches up
+QUEUE_SIZE = 4
 
-        self._bytes = {"stdout": b"", "stderr": b""}
+_Event = Tuple[int, bytes]
 
-        self._stdout: Optional[str] = None
-        self._stderr: Optional[str] = None
 
-        self._start_time = time.time()
+class Subprocess:
+    """
+    Shell command with streamed output.
 
-    def _time_remaining(self, timeout: Optional[float]) -> float:
-        if timeout is None:
-            return 1
+    Iterating yields (stream, chunk) pairs as output arrives, stream is STDOUT or
+    STDERR. Output is read only as fast as it is consumed: process blocks on full pipe
+    while consumer is busy. Head and tail of each stream are kept in stdout and stderr
+    buffers.
 
-        return timeout - (time.time() - self._start_time)
+    Process runs in its own process group, whole group is killed after timeout, once
+    output exceeds cap and on exit from context manager if process is still running.
+    """
 
-    @property
-    def stdout(self) -> str:
-        if not self.exited:
-            raise RuntimeError("Process is still running")
-
-        if self._stdout is None:
-            self._stdout = self._bytes["stdout"].decode(errors="replace")
+    def __init__(
+        self,
+        process: asyncio.subprocess.Process,
+        input: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+        head: int = DEFAULT_HEAD,
+        tail: int = DEFAULT_TAIL,
+        cap: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        assert process.stdout is not None
+        assert process.stderr is not None
 
-        return self._stdout
+        self._process = process
+        self._cap = cap
+        self._chunk_size = chunk_size
+
+        self.stdout = HeadTailBuffer(head, tail)
+        self.stderr = HeadTailBuffer(head, tail)
+
+        self.timed_out = False
+        self.over_cap = False
+
+        # b"" marks end of stream
+        self._queue: "asyncio.Queue[_Event]" = asyncio.Queue(QUEUE_SIZE)
+        self._open_streams = 2
+
+        self._tasks: List["asyncio.Task[None]"] = [
+            asyncio.create_task(self._read(STDOUT, process.stdout)),
+            asyncio.create_task(self._read(STDERR, process.stderr)),
+        ]
+        if process.stdin is not None:
+            self._tasks.append(asyncio.create_task(self._write(process.stdin, input)))
+
+        self._timeout_handle = (
+            None
+            if timeout is None
+            else asyncio.get_running_loop().call_later(timeout, self._expire)
+        )
 
-    @property
-    def stderr(self) -> str:
-        if not self.exited:
-            raise RuntimeError("Process is still running")
+    @classmethod
+    async def start(
+        cls,
+        command: str,
+        input: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+        head: int = DEFAULT_HEAD,
+        tail: int = DEFAULT_TAIL,
+        cap: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> "Subprocess":
+        """Program stdin is empty if input is None."""
+
+        log.debug("running shell command: %s", command)
+
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.DEVNULL
+            if input is None
+            else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
 
-        if self._stderr is None:
-            self._stderr = self._bytes["stderr"].decode(errors="replace")
+        return cls(process, input, timeout, head, tail, cap, chunk_size)
 
-        return self._stderr
+    async def _read(self, stream_type: int, reader: asyncio.StreamReader) -> None:
+        while True:
+            chunk = await reader.read(self._chunk_size)
+            await self._queue.put((stream_type, chunk))
 
-    async def _wait(self, timeout: Optional[float]) -> None:
-        await asyncio.wait_for(
-            self._process.wait(), timeout=self._time_remaining(timeout)
-        )
+            if not chunk:
+                return
 
-    # no longer needed
-    async def read(
-        self,
-        limit: Optional[int] = None,
-        *,
-        timeout: Optional[float],
-        input: Optional[bytes] = None,
-        interval: float = 0.3,
-        rate: float = 100,
-        kill_after_limit: bool = True,
+    async def _write(
+        self, writer: asyncio.StreamWriter, input: Optional[bytes]
     ) -> None:
+        try:
+            if input:
+                writer.write(input)
+                await writer.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # process exited or closed stdin without reading everything
+        finally:
+            writer.close()
 
-        stdin = self._process.stdin
-        stdout = self._process.stdout
-        stderr = self._process.stderr
+    def _expire(self) -> None:
+        log.debug("killing process %d after timeout", self._process.pid)
 
-        if stdout is None:
-            raise RuntimeError("stdout reader is missing")
+        self.timed_out = True
+        self.kill()
 
-        if stderr is None:
-            raise RuntimeError("stderr reader is missing")
+    def kill(self) -> None:
+        # children may hold pipes open after shell exited, group id stays taken
+        # while any of them runs
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except ProcessLookupError:  # whole group is gone
+            pass
 
-        if stdin is not None:
-            if input is not None:
-                stdin.write(input)
-                await stdin.drain()
+    def __aiter__(self) -> AsyncIterator[_Event]:
+        return self._events()
 
-            stdin.close()
+    async def _events(self) -> AsyncIterator[_Event]:
+        while self._open_streams:
+            stream_type, chunk = await self._queue.get()
+            if not chunk:
+                self._open_streams -= 1
 
-        read_limit = DEFAULT_READ_LIMIT if limit is None else limit
-        chunk_size = int(read_limit * interval / rate) or MIN_CHUNK_SIZE
+                continue
 
-        tasks: Dict[str, Optional[asyncio.Task[bytes]]] = {
-            "stdout": None,
-            "stderr": None,
-        }
+            (self.stdout if stream_type == STDOUT else self.stderr).write(chunk)
 
-        async def read_task(stream: asyncio.StreamReader, name: str) -> None:
-            nonlocal read_limit
+            if (
+                self._cap is not None
+                and not self.over_cap
+                and self.stdout.received + self.stderr.received > self._cap
+            ):
+                self.over_cap = True
+                self.kill()
 
-            chunk = await stream.read(chunk_size)
-            read_limit -= len(chunk)
-            self._bytes[name] += chunk
+            yield stream_type, chunk
 
-            tasks[name] = None
+    async def wait(self) -> int:
+        """Reads remaining output, returns exit code."""
 
-        stream_pairs = list(zip(("stdout", "stderr"), (stdout, stderr)))
-        try:
-            while self._time_remaining(timeout) > 0 and read_limit > 0:
-                for name, stream in stream_pairs:
-                    if tasks[name] is None and not stream.at_eof():
-                        tasks[name] = asyncio.create_task(read_task(stream, name))
-
-                to_wait = [t for t in tasks.values() if t is not None]
-                if not to_wait:
-                    break
-
-                done, pending = await asyncio.wait(
-                    to_wait, timeout=interval, return_when=asyncio.FIRST_COMPLETED
-                )
-
-                if not done:
-                    continue
-
-            for task in pending:
-                task.cancel()
-
-            if read_limit <= 0:
-                if kill_after_limit:
-                    self._process.kill()
-                else:
-                    await self._wait(timeout)
-        finally:
-            for t in tasks.values():
-                if t is not None:
-                    t.cancel()
+        async for _ in self:
+            pass
+
+        return await self._finish()
+
+    async def _finish(self) -> int:
+        exit_code = await self._process.wait()
+
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+
+        for task in self._tasks:
+            task.cancel()
 
-            if not self.exited:
-                if self._finally_kill:
-                    self._process.kill()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
 
-            await self._process.wait()
+        return exit_code
+
+    async def __aenter__(self) -> "Subprocess":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.kill()
+
+        # pipes are closed once killed processes are gone
+        await self.wait()
 
     @property
-    def exited(self) -> bool:
-        return self.exit_code is not None
+    def pid(self) -> int:
+        return self._process.pid
 
     @property
-    def exit_code(self) -> int:
+    def exit_code(self) -> Optional[int]:
         return self._process.returncode
 
     def __repr__(self) -> str:
-        return f"<{self.__class__.__name__} exit_code={self.exit_code} stdout={self.stdout} stderr={self.stderr}>"
+        return f"<{self.__class__.__name__} pid={self.pid} exit_code={self.exit_code}>"
 
 
 async def run_shell_command(
     command: str,
     input: Optional[bytes] = None,
-    wait: bool = False,
     timeout: Optional[float] = None,
-    limit: Optional[int] = None,
-    read: bool = True,
-) -> ShellResult:
-    # TODO: input processing
-    log.debug("running shell command: %s", command)
-
-    process = await asyncio.create_subprocess_shell(
-        command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        stdin=asyncio.subprocess.PIPE if input is not None else None,
-    )
-
-    result = ShellResult(process)
-
-    if not wait:
-        return result
-
-    kwargs = dict(timeout=timeout, input=input)
-
-    if not read:
-        kwargs["kill_after_limit"] = False
-
-    await result.read(0 if not read else limit, **kwargs)  # type:ignore
-
-    return result
+    head: int = DEFAULT_HEAD,
+    tail: int = DEFAULT_TAIL,
+    cap: Optional[int] = None,
+) -> Subprocess:
+    """Runs command to completion, output is in stdout and stderr of result."""
+
+    async with await Subprocess.start(
+        command, input, timeout, head, tail, cap
+    ) as process:
+        await process.wait()
+
+    return process